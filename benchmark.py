@@ -0,0 +1,425 @@
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import click
+import numpy as np
+from loguru import logger
+from PIL import Image
+from websocket._exceptions import WebSocketConnectionClosedException
+
+from src.board import BoardSubscriber
+from src.distance import METRICS
+from src.mappings import ColorMapper
+from src.parallel import ParallelBackend
+from src.pixels import WorkPool
+from src.recording import CONFIG, BoardReplay, read_records
+from src.tiles import Tiles
+import src.utils as utils
+
+# (width, height) of the benchmarked board and template
+SIZES = {
+    "small": (250, 250),
+    "medium": (1000, 1000),
+    "large": (3000, 2000),
+}
+
+# Subcanvas size of the synthetic board, like the reddit canvas
+CANVAS_SIZE = 1000
+
+# Memory ceiling of the tiled correction in bytes
+TILED_MAX_MEMORY = 64 * 2**20
+
+# Templates, diff frames and pool updates per run
+TEMPLATE_COUNT = 8
+DIFF_FRAMES = 100
+DIFF_PIXELS = 50
+
+# Red values of the lookup table built per color metric, of 256
+LUT_ROWS = 4
+
+# Benchmarks whose peak memory is traced as well, in one extra untimed run
+MEMORY_CASES = {
+    "correct_image",
+    "correct_image_tiled",
+    "correct_image_lut",
+    "index_template",
+    "tiles_index_template",
+}
+
+
+def synthetic_template(rng, width, height):
+    """
+    RGBA template of blocks of palette colors with some noise on top, like an
+    upscaled drawing, with transparent holes. debug/test_template.png is
+    stamped into the corner so real template colors are part of the input.
+    """
+    palette = ColorMapper.palette_to_rgb(ColorMapper.FULL_COLOR_MAP)
+    block = 8
+    blocks = rng.integers(0, len(palette), (height // block + 1, width // block + 1))
+    image = np.empty((height, width, 4), dtype=np.uint8)
+    rgb = palette[blocks.repeat(block, 0).repeat(block, 1)[:height, :width]]
+    noise = rng.integers(-12, 13, (height, width, 3))
+    image[..., :3] = np.clip(rgb.astype(int) + noise, 0, 255)
+    alpha = rng.random((height // block + 1, width // block + 1)) > 0.2
+    image[..., 3] = alpha.repeat(block, 0).repeat(block, 1)[:height, :width] * 255
+
+    sample = np.array(Image.open("debug/test_template.png").convert("RGBA"))
+    h, w = min(sample.shape[0], height), min(sample.shape[1], width)
+    image[:h, :w] = sample[:h, :w]
+    return image
+
+
+def synthetic_board(rng, template_ids):
+    # Board that already matches the template for 70% of the pixels
+    board = rng.integers(0, 32, template_ids.shape, dtype=np.uint8)
+    keep = (rng.random(template_ids.shape) < 0.7) & (
+        template_ids != ColorMapper.TRANSPARENT
+    )
+    board[keep] = template_ids[keep]
+    return board
+
+
+def subscriber(width, height):
+    # Subscriber whose region is the whole synthetic board
+    board = BoardSubscriber(SimpleNamespace(stop_event=threading.Event()))
+    board.canvas_details = {
+        "canvasWidth": CANVAS_SIZE,
+        "canvasHeight": CANVAS_SIZE,
+        "canvasConfigurations": [
+            {"index": i, "dx": dx, "dy": dy}
+            for i, (dy, dx) in enumerate(
+                (dy, dx)
+                for dy in range(0, height, CANVAS_SIZE)
+                for dx in range(0, width, CANVAS_SIZE)
+            )
+        ],
+    }
+    board.set_region((0, 0, width, height))
+    board.subscribed = board.overlapping()
+    return board
+
+
+def fixed(*args):
+    # Setup of a benchmark that runs on the same arguments every time
+    return lambda: args
+
+
+def cases(rng, width, height, backend=None):
+    """
+    Yields (name, setup, run), setup() returns the arguments of run.
+    With a ParallelBackend the correction is also run across its processes.
+    """
+    template = synthetic_template(rng, width, height)
+    colors = ColorMapper.FULL_COLOR_MAP
+    palette = ColorMapper.palette_to_rgb(colors)
+    ColorMapper.load_lut(palette)  # built once, not part of any case
+    template_ids = ColorMapper.index_template(template, colors)
+    board_ids = synthetic_board(rng, template_ids)
+
+    yield "redmean_dist", fixed(template, palette[0]), ColorMapper.redmean_dist
+    yield "correct_image", fixed(template, colors), ColorMapper.correct_image
+    yield "correct_image_tiled", fixed(
+        template, colors, TILED_MAX_MEMORY
+    ), ColorMapper.correct_image
+    yield "correct_image_lut", fixed(template, colors), ColorMapper.correct_image_lut
+    yield "index_template", fixed(template, colors), ColorMapper.index_template
+    yield "tiles_index_template", fixed(template, colors), Tiles(
+        template
+    ).index_template
+    for name, metric in METRICS.items():
+        yield f"{name}_distance", fixed(template, palette[0]), metric.distance
+        yield f"{name}_lut_rows", fixed(palette, 0, LUT_ROWS), metric.nearest_rows
+    if backend:
+        yield "build_lut", fixed(palette), ColorMapper.build_lut
+        yield "parallel_build_lut", fixed(palette), backend.build_lut
+        yield "parallel_correct_image", fixed(template, colors), backend.correct_image
+        yield "parallel_index_template", fixed(template, colors), backend.index_template
+
+    # Board compositing: full frames of every subcanvas, then diff frames
+    def full_frames(board, frames):
+        for i, frame in enumerate(frames):
+            board.apply_full_frame(i, {"timestamp": 1}, (frame, None, None))
+
+    def full_frames_setup():
+        board = subscriber(width, height)
+        frames = [
+            rng.integers(0, 32, (CANVAS_SIZE, CANVAS_SIZE), dtype=np.uint8)
+            for _ in board.subscribed
+        ]
+        return board, frames
+
+    yield "board_full_frames", full_frames_setup, full_frames
+
+    def diff_frames(board, frames):
+        # every diff continues from the previous frame of its subcanvas
+        timestamps = dict(board.timestamps)
+        for i, frame in frames:
+            data = {
+                "previousTimestamp": timestamps[i],
+                "currentTimestamp": timestamps[i] + 1,
+            }
+            timestamps[i] += 1
+            board.apply_diff_frame(None, i, data, frame)
+
+    def diff_frames_setup():
+        board, full = full_frames_setup()
+        full_frames(board, full)
+        frames = []
+        for _ in range(DIFF_FRAMES):
+            i = int(rng.integers(0, len(full)))
+            changed = np.zeros((CANVAS_SIZE, CANVAS_SIZE), dtype=bool)
+            changed.flat[rng.integers(0, changed.size, DIFF_PIXELS)] = True
+            frames.append((i, (full[i], changed, None)))
+        return board, frames
+
+    yield "board_diff_frames", diff_frames_setup, diff_frames
+
+    # Wrong pixels: full rebuild and incremental updates of small boxes
+    board = np.swapaxes(board_ids, 0, 1).copy()
+    template_xy = np.swapaxes(template_ids, 0, 1).copy()
+    layers = rng.integers(0, TEMPLATE_COUNT, template_xy.shape)
+
+    def new_pool():
+        return WorkPool(template_xy.shape, palette, ["template", "distance"], layers)
+
+    def rebuild_setup():
+        return new_pool(), board, template_xy
+
+    yield "work_pool_rebuild", rebuild_setup, WorkPool.rebuild
+
+    def updates_setup():
+        pool = new_pool()
+        pool.rebuild(board, template_xy)
+        changed = board.copy()
+        boxes = []
+        for _ in range(DIFF_FRAMES):
+            x, y = rng.integers(0, (width - 4, height - 4))
+            changed[x : x + 4, y : y + 4] = rng.integers(0, 32, (4, 4))
+            boxes.append((x, y, x + 4, y + 4))
+        return pool, changed, boxes
+
+    def updates(pool, changed, boxes):
+        for box in boxes:
+            pool.update(changed, template_xy, box)
+
+    yield "work_pool_update", updates_setup, updates
+
+    def pop_all(pool):
+        while pool.pop() is not None:
+            pass
+
+    def pop_setup():
+        pool = new_pool()
+        pool.rebuild(board, template_xy)
+        return (pool,)
+
+    yield "work_pool_pop_all", pop_setup, pop_all
+
+    # Template merging of overlapping templates
+    def merge_setup():
+        images, coords = [], []
+        for _ in range(TEMPLATE_COUNT):
+            w = int(rng.integers(width // 4, width // 2 + 1))
+            h = int(rng.integers(height // 4, height // 2 + 1))
+            x = int(rng.integers(0, width - w + 1))
+            y = int(rng.integers(0, height - h + 1))
+            images.append(Image.fromarray(template[y : y + h, x : x + w], "RGBA"))
+            coords.append((x, y))
+        return images, np.array(coords)
+
+    yield "merge_templates", merge_setup, utils.merge_templates
+
+
+def replay_case(path):
+    """
+    Setup and run of playing a recorded board stream through the subscriber
+    as fast as the frames decode, the region is the whole canvas.
+    """
+    for _, kind, config, _ in read_records(path):
+        if kind == CONFIG:
+            break
+    else:
+        raise click.ClickException(f"{path} has no canvas configuration")
+    width = max(c["dx"] for c in config["canvasConfigurations"])
+    height = max(c["dy"] for c in config["canvasConfigurations"])
+    region = (0, 0, width + config["canvasWidth"], height + config["canvasHeight"])
+
+    def setup():
+        replay = BoardReplay(path, speed=0)
+        board = BoardSubscriber(SimpleNamespace(stop_event=threading.Event()), replay)
+        board.set_region(region)
+        return board, replay
+
+    def run(board, replay):
+        ws = replay.connect_realtime(None, None)
+        try:
+            board.listen(ws)
+        except WebSocketConnectionClosedException:
+            pass  # end of the recording
+        while board.pending:
+            board.pending[0][-1].result()
+            board.apply_pending(ws)
+
+    return setup, run
+
+
+def measure(setup, run, repeats, memory=False):
+    times = []
+    for _ in range(repeats):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+    result = {
+        "min": min(times),
+        "median": statistics.median(times),
+        "repeats": repeats,
+    }
+    if memory:
+        # Peak of what run allocates, tracing slows it down so it isn't timed
+        args = setup()
+        tracemalloc.start()
+        try:
+            run(*args)
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def report(name, result, note=""):
+    peak = ""
+    if "peak_bytes" in result:
+        peak = f" {result['peak_bytes'] / 2**20:9.1f} MB peak"
+    print(f"{name:40} {result['min'] * 1000:10.2f} ms{peak}{note}")
+
+
+def compare(results, baseline, tolerance):
+    # Prints the change against the baseline, returns the regressed benchmarks
+    # Time and, where both runs traced it, peak memory are compared
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            report(name, result, "   (new)")
+            continue
+        ratio = result["min"] / baseline[name]["min"]
+        note = f"  x{ratio:5.2f}"
+        if ratio > 1 + tolerance:
+            note += "  REGRESSION"
+            regressions.append(name)
+        if "peak_bytes" in result and baseline[name].get("peak_bytes"):
+            memory = result["peak_bytes"] / baseline[name]["peak_bytes"]
+            note += f"  memory x{memory:5.2f}"
+            if memory > 1 + tolerance:
+                note += "  MEMORY REGRESSION"
+                regressions.append(name)
+        report(name, result, note)
+    return regressions
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--size",
+    "sizes",
+    multiple=True,
+    type=click.Choice(list(SIZES)),
+    default=["small", "medium"],
+    show_default=True,
+    help="Board sizes to benchmark, can be given more than once.",
+)
+@click.option(
+    "-k",
+    "--only",
+    default="",
+    help="Only run the benchmarks whose name contains this text.",
+)
+@click.option("-r", "--repeats", default=5, show_default=True)
+@click.option(
+    "-o",
+    "--output",
+    default="benchmark.json",
+    show_default=True,
+    help="Where the results are written, usable as a baseline later.",
+)
+@click.option(
+    "-b",
+    "--baseline",
+    default=None,
+    help="Results of an earlier run to compare with.",
+)
+@click.option(
+    "-t",
+    "--tolerance",
+    default=0.25,
+    show_default=True,
+    help="Slowdown against the baseline counted as a regression.",
+)
+@click.option(
+    "--replay",
+    default=None,
+    help="Board recording to play through the subscriber as well.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    default=0,
+    show_default=True,
+    help="Worker processes of the parallel backend, its benchmarks only run if set.",
+)
+@click.option("--seed", default=0, show_default=True)
+def main(sizes, only, repeats, output, baseline, tolerance, replay, workers, seed):
+    """Offline benchmarks of the image pipeline on synthetic boards."""
+    logger.remove()  # subscriber debug output would be timed as well
+    backend = ParallelBackend(workers) if workers else None
+
+    results = {}
+    try:
+        for size in sizes:
+            rng = np.random.default_rng(seed)
+            for case, setup, run in cases(rng, *SIZES[size], backend):
+                name = f"{case}/{size}"
+                if only not in name:
+                    continue
+                results[name] = measure(setup, run, repeats, case in MEMORY_CASES)
+                report(name, results[name])
+    finally:
+        if backend:
+            backend.shutdown()
+
+    if replay:
+        name = f"board_replay/{os.path.basename(replay)}"
+        results[name] = measure(*replay_case(replay), repeats)
+        report(name, results[name])
+
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "timestamp": time.time(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {output}")
+
+    if baseline:
+        with open(baseline) as f:
+            previous = json.load(f)["results"]
+        print(f"Compared with {baseline}")
+        if compare(results, previous, tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import sys
 from loguru import logger
 
 from src.place import PlaceClient
+from src.profiler import Profiler
 
 
 @click.command()
@@ -24,15 +25,31 @@ from src.place import PlaceClient
     default="canvas.json",
     help="Location of canvas.json",
 )
-def main(debug: bool, config: str, canvas: str):
+@click.option(
+    "-p",
+    "--profile",
+    is_flag=True,
+    help="Profile every thread, writes folded stacks and a summary of the "
+    "client phases to the profiles directory on exit.",
+)
+def main(debug: bool, config: str, canvas: str, profile: bool):
     if not debug:
         # default loguru level is DEBUG
         logger.remove()
         logger.add(sys.stderr, level="INFO")
 
-    client = PlaceClient(config_path=config, canvas_path=canvas)
-    # Start everything
-    client.start()
+    profiler = Profiler() if profile else None
+    if profiler:
+        profiler.start()
+
+    try:
+        client = PlaceClient(config_path=config, canvas_path=canvas)
+        # Start everything
+        client.start()
+    finally:
+        if profiler:
+            profiler.stop()
+            logger.info("Profile written to {}.*", profiler.write())
 
 
 if __name__ == "__main__":
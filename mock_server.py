@@ -0,0 +1,85 @@
+import sys
+import threading
+
+import click
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+from src.mappings import ColorMapper
+from src.mock import MockCanvas, MockServer
+
+
+def log_stats(server: MockServer, interval):
+    # Placement throughput for load tests
+    previous = dict(server.canvas.stats)
+    while not server.stop_event.wait(interval):
+        stats = dict(server.canvas.stats)
+        logger.info(
+            "Mock: {:.1f} pixels/s placed, {:.1f}/s rate limited, "
+            "{:.1f} frames/s served, {} subscriptions",
+            (stats["placed"] - previous["placed"]) / interval,
+            (stats["rate_limited"] - previous["rate_limited"]) / interval,
+            (stats["frames"] - previous["frames"]) / interval,
+            len(server.canvas.subscribers),
+        )
+        previous = stats
+
+
+@click.command()
+@click.option("-d", "--debug", is_flag=True, help="Log every request.")
+@click.option("-H", "--host", default="127.0.0.1", show_default=True)
+@click.option("-p", "--port", default=8080, show_default=True)
+@click.option("--canvases", default=6, show_default=True, help="Subcanvas count.")
+@click.option("--canvas-size", default=1000, show_default=True)
+@click.option(
+    "--cooldown", default=300.0, show_default=True, help="Seconds between pixels."
+)
+@click.option(
+    "--noise",
+    default=0.0,
+    show_default=True,
+    help="Pixels set per second by simulated players.",
+)
+@click.option(
+    "--tick", default=1.0, show_default=True, help="Seconds between diff frames."
+)
+@click.option("--board", default=None, help="Image the board starts with.")
+@click.option(
+    "--files",
+    default=".",
+    show_default=True,
+    help="Directory served below /files/, for template manifests and images.",
+)
+def main(debug, host, port, canvases, canvas_size, cooldown, noise, tick, board, files):
+    """Local stand-in for the r/place realtime endpoints."""
+    if not debug:
+        logger.remove()
+        logger.add(sys.stderr, level="INFO")
+
+    if board:
+        image = np.asarray(Image.open(board).convert("RGB"))
+        board = ColorMapper.index_image_lut(image, ColorMapper.FULL_COLOR_MAP)
+    canvas = MockCanvas(canvases, canvas_size, cooldown, noise, board)
+    server = MockServer((host, port), canvas, files, tick)
+    threading.Thread(target=log_stats, args=(server, 10), daemon=True).start()
+
+    url = f"{host}:{port}"
+    logger.info("Mock: Listening on {}, use these endpoints in config.json:", url)
+    print(
+        '"endpoints": {',
+        f'    "query": "http://{url}/query",',
+        f'    "realtime": "ws://{url}/query",',
+        f'    "reddit": "http://{url}",',
+        f'    "new_reddit": "http://{url}"',
+        "}",
+        sep="\n",
+    )
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        logger.warning("Mock: KeyboardInterrupt received, exiting...")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,42 @@ import nox
 locations = (
     "main.py",
     "noxfile.py",
+    "benchmark.py",
+    "mock_server.py",
     "src/mappings.py",
     "src/proxy.py",
     "src/utils.py",
     "src/place.py",
     "src/connect.py",
+    "src/board.py",
+    "src/pixels.py",
+    "src/cache.py",
+    "src/scheduler.py",
+    "src/artifacts.py",
+    "src/mock.py",
+    "src/recording.py",
+    "src/metrics.py",
+    "src/profiler.py",
+    "src/config.py",
+    "src/tiles.py",
+    "src/parallel.py",
+    "src/warmstart.py",
+    "src/distance.py",
+    "test/test_lut.py",
+    "test/test_correction.py",
+    "test/test_board.py",
+    "test/test_merge.py",
+    "test/test_tiles.py",
+    "test/test_parallel.py",
+    "test/test_distance.py",
+    "test/test_scheduler.py",
+    "test/test_pixels.py",
+    "test/test_palette.py",
+    "test/test_config.py",
+    "test/test_cache.py",
+    "test/test_recording.py",
+    "test/test_warmstart.py",
+    "test/conftest.py",
 )
 
 
@@ -26,4 +57,10 @@ def lint(session):
     session.run("flake8", *args)
 
 
+@nox.session
+def tests(session):
+    session.install("-r", "requirements.txt", "pytest")
+    session.run("pytest", *session.posargs)
+
+
 nox.options.sessions = ["lint"]
@@ -0,0 +1,87 @@
+import threading
+import time
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+from src.distance import get_metric
+from src.mappings import ColorMapper
+
+
+def save_as_png(image, filename):
+    image = np.swapaxes(image, 0, 1).astype(np.uint8)
+    image = Image.fromarray(image, "RGBA")
+    image.save(filename)
+
+
+def template_image(template, palette):
+    opaque = template != ColorMapper.TRANSPARENT
+    image = np.zeros((*template.shape, 4), dtype=np.uint8)
+    image[opaque, :3] = palette[template[opaque]]
+    image[opaque, 3] = 255
+    return image
+
+
+def board_image(board, covered, palette):
+    # The board is only kept up to date where covered
+    image = np.empty((*board.shape, 4), dtype=np.uint8)
+    image[..., :3] = palette[board]
+    image[..., 3] = covered * 255
+    return image
+
+
+def dist_image(board, template, palette, metric="redmean"):
+    # Color distance of the board to the template, scaled to 0-255
+    opaque = template != ColorMapper.TRANSPARENT
+    distances = get_metric(metric).table(palette)
+    dist = distances[board, np.where(opaque, template, 0)].astype(float)
+    image = np.empty((*dist.shape[:2], 4))
+    image[..., :3] = dist[..., None] * 255 // max(dist.max(), 1)
+    image[..., 3] = opaque * 255
+    return image
+
+
+class ArtifactWriter:
+    """
+    Writes debug images from a background thread.
+    Requests for the same file are coalesced, only the latest one is written,
+    and files are written at most once every interval() seconds.
+    """
+
+    def __init__(self, stop_event: threading.Event, interval):
+        self.stop_event = stop_event
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.pending = {}  # filename -> (render, args)
+        self.thread = None
+
+    def submit(self, filename, render, *args):
+        # render(*args) is called on the writer thread and returns the image
+        with self.cond:
+            self.pending[filename] = (render, args)
+            self.cond.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="artifacts", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        last_write = 0
+        while not self.stop_event.is_set():
+            with self.cond:
+                while not self.pending and not self.stop_event.is_set():
+                    self.cond.wait(timeout=1)
+
+            # Requests arriving meanwhile replace the older ones
+            if self.stop_event.wait(max(0, last_write + self.interval() - time.time())):
+                return
+
+            with self.cond:
+                pending, self.pending = self.pending, {}
+            for filename, (render, args) in pending.items():
+                try:
+                    save_as_png(render(*args), filename)
+                except Exception:
+                    logger.exception("Failed to write debug image {}", filename)
+            last_write = time.time()
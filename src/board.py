@@ -0,0 +1,386 @@
+import json
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from loguru import logger
+from PIL import Image
+from websocket._exceptions import (
+    WebSocketConnectionClosedException,
+    WebSocketException,
+    WebSocketTimeoutException,
+)
+
+import src.connect as connect
+from src.mappings import ColorMapper
+from src.metrics import metrics
+from src.profiler import phase
+
+# Number of applied frames whose changed area is remembered
+CHANGE_HISTORY = 1024
+
+
+def intersect(a, b):
+    # Intersection of two (x0, y0, x1, y1) boxes, None if they don't overlap
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+class BoardSubscriber:
+    """
+    Keeps a live copy of the board region from a single websocket subscription.
+    Only the subcanvases overlapping the region are subscribed to, their full
+    frames are downloaded once per subscription, afterwards every
+    DiffFrameMessageData is written into the region buffer.
+    The websocket and the frames come from source, the connect module or a
+    BoardReplay, and can be appended to a BoardRecorder.
+    """
+
+    def __init__(self, client, source=connect, recorder=None):
+        self.client = client
+        self.source = source
+        self.recorder = recorder
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.thread = None
+        self.access_token = None
+
+        # Board state, guarded by self.lock
+        self.canvas_details = None
+        self.colors = None
+        self.region = None  # (x0, y0, x1, y1) of the board kept in memory
+        self.areas = None  # boxes of the region that are used, all of it if None
+        self.region_changed = False
+        self.board: np.ndarray = None  # palette index of the region pixels, [y, x]
+        self.timestamps = {}  # canvas index -> timestamp of the last applied frame
+        self.version = 0  # increases every time a frame is applied
+        self.changes = deque(maxlen=CHANGE_HISTORY)  # (version, changed box)
+
+        # Only used by the subscriber thread
+        self.subscribed = set()  # canvas indices subscribed on the current socket
+
+        # Frames are downloaded and decoded concurrently but applied in order
+        self.downloads = ThreadPoolExecutor(
+            max_workers=connect.FRAME_DOWNLOAD_WORKERS,
+            thread_name_prefix="board-download",
+        )
+        # (canvas index, frame message, palette, region, receive time, future)
+        self.pending = deque()
+
+    def start(self, access_token):
+        self.access_token = access_token
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(
+            target=self.run, name="board-subscriber", daemon=True
+        )
+        self.thread.start()
+
+    def set_region(self, region, areas=None):
+        # Keep the given (x0, y0, x1, y1) part of the board from now on
+        # With areas only the subcanvases overlapping one of these boxes are kept
+        region = tuple(int(v) for v in region)
+        if areas is not None:
+            areas = [tuple(int(v) for v in box) for box in areas]
+        with self.lock:
+            if region == self.region and areas == self.areas:
+                return
+            logger.debug("Board region: {}", region)
+            self.region = region
+            self.areas = areas
+            self.board = np.zeros(
+                (region[3] - region[1], region[2] - region[0]), dtype=np.uint8
+            )
+            self.reset()
+
+    def reset(self):
+        # Every subcanvas has to send a new full frame, called with self.lock held
+        self.region_changed = True
+        self.timestamps.clear()
+        self.changes.clear()
+        self.version += 1
+        self.ready.clear()
+
+    def wait_ready(self):
+        # Blocks until every overlapping subcanvas received its full frame
+        while not self.ready.wait(timeout=1):
+            if self.client.stop_event.is_set():
+                return False
+        return True
+
+    def get_colors(self):
+        with self.lock:
+            return dict(self.colors)
+
+    def crop(self, box):
+        # Crop of the live board inside the region, indexed [y, x]
+        # and the board version it was taken from
+        with self.lock:
+            x0, y0 = self.region[:2]
+            crop = self.board[box[1] - y0 : box[3] - y0, box[0] - x0 : box[2] - x0]
+            return crop.copy(), self.version
+
+    def changes_since(self, version):
+        """
+        Boxes changed after the given board version and the current version.
+        The boxes are None if the history doesn't reach back that far.
+        """
+        with self.lock:
+            if version == self.version:
+                return [], version
+            if not self.changes or self.changes[0][0] > version + 1:
+                return None, self.version
+            boxes = [box for v, box in self.changes if v > version and box]
+            return boxes, self.version
+
+    def record_change(self, box):
+        # Called with self.lock held
+        self.version += 1
+        self.changes.append((self.version, box))
+
+    def run(self):
+        while not self.client.stop_event.is_set():
+            ws = self.source.connect_realtime(self.client, self.access_token)
+            if ws is None:
+                return
+            self.subscribed.clear()
+            self.pending.clear()
+            try:
+                ws.settimeout(1)
+                connect.subscribe_configuration(ws)
+                self.listen(ws)
+            except (WebSocketException, OSError, KeyError, ValueError) as e:
+                logger.error("Board subscription lost: {}", e)
+            finally:
+                ws.close()
+
+            # Frames missed while disconnected can't be diffed, resync from scratch
+            with self.lock:
+                self.timestamps.clear()
+            self.ready.clear()
+            logger.warning("Reconnecting board subscription in 5 seconds...")
+            self.client.stop_event.wait(5)
+
+    def listen(self, ws):
+        while not self.client.stop_event.is_set():
+            if self.region_changed and self.canvas_details:
+                self.subscribe(ws, resync=True)
+            self.apply_pending(ws)
+            # Poll quickly while downloads are in flight
+            ws.settimeout(0.05 if self.pending else 1)
+            try:
+                msg = ws.recv()
+            except WebSocketTimeoutException:
+                continue
+            if not msg:
+                raise WebSocketConnectionClosedException("Empty message received")
+
+            msg = json.loads(msg)
+            if msg["type"] in ("connection_error", "error"):
+                raise WebSocketException(msg.get("payload"))
+            if msg["type"] != "data":
+                continue
+
+            data = msg["payload"]["data"]["subscribe"]["data"]
+            if msg["id"] == "1":
+                self.configure(ws, data)
+                continue
+            canvas_index = int(msg["id"]) - 2
+            if canvas_index not in self.subscribed:
+                continue  # sent before the canvas was unsubscribed
+            if data["__typename"] == "FullFrameMessageData":
+                self.download(canvas_index, data, "RGB")
+            elif data["__typename"] == "DiffFrameMessageData":
+                self.download(canvas_index, data, "RGBA")
+
+    def configure(self, ws, canvas_details):
+        logger.debug("Canvas config: {}", canvas_details)
+        if self.recorder:
+            self.recorder.config(time.time(), canvas_details)
+        colors = {
+            color["hex"]: color["index"]
+            for color in canvas_details["colorPalette"]["colors"]
+        }
+        with self.lock:
+            self.canvas_details = canvas_details
+            if self.colors is not None and self.colors != colors:
+                # The board indices refer to the old palette
+                logger.warning("Color palette changed, reloading the board")
+                self.reset()
+            self.colors = colors
+        self.subscribe(ws, resync=False)
+
+    def overlapping(self):
+        # Indices of the subcanvases overlapping the region, or its areas
+        if self.region is None:
+            return set()
+        width = self.canvas_details["canvasWidth"]
+        height = self.canvas_details["canvasHeight"]
+        areas = [self.region] if self.areas is None else self.areas
+        return {
+            c["index"]
+            for c in self.canvas_details["canvasConfigurations"]
+            if any(
+                intersect((c["dx"], c["dy"], c["dx"] + width, c["dy"] + height), box)
+                for box in areas
+            )
+        }
+
+    def subscribe(self, ws, resync):
+        # Subscribe to the overlapping subcanvases only, with resync every
+        # subcanvas sends a new full frame for the new region buffer
+        with self.lock:
+            self.region_changed = False
+            wanted = self.overlapping()
+        stale = self.subscribed if resync else self.subscribed - wanted
+        new = wanted if resync else wanted - self.subscribed
+        for canvas_index in stale:
+            connect.unsubscribe(ws, connect.canvas_socket_id(canvas_index))
+        for canvas_index in new:
+            connect.subscribe_canvas(ws, canvas_index)
+        self.subscribed = wanted
+        logger.debug("Subscribed to canvases {}", sorted(wanted))
+
+    def canvas_offset(self, canvas_index):
+        for configuration in self.canvas_details["canvasConfigurations"]:
+            if configuration["index"] == canvas_index:
+                return int(configuration["dx"]), int(configuration["dy"])
+        raise KeyError(f"Unknown canvas {canvas_index}")
+
+    def download(self, canvas_index, data, mode):
+        logger.debug("Getting frame {}: {}", canvas_index, data["name"])
+        with self.lock:
+            region = self.region
+            dx, dy = self.canvas_offset(canvas_index)
+            width = self.canvas_details["canvasWidth"]
+            height = self.canvas_details["canvasHeight"]
+            box = intersect((dx, dy, dx + width, dy + height), region)
+        # Only the part of the frame inside the region is decoded
+        window = None
+        if box is not None:
+            window = np.s_[box[1] - dy : box[3] - dy, box[0] - dx : box[2] - dx]
+        future = self.downloads.submit(
+            self.fetch_frame, data["name"], mode, self.colors, window
+        )
+        self.pending.append(
+            (canvas_index, data, self.colors, region, time.time(), future)
+        )
+
+    def fetch_frame(self, url, mode, colors, window=None):
+        """
+        Runs on the download pool, decodes the frame straight to palette indices.
+        Returns the indices, for diff frames the mask of changed pixels, and
+        the downloaded image. With a window, a [y, x] slice of the frame, the
+        indices and mask are only filled in inside of it.
+        """
+        with metrics.time("board_frame_fetch_seconds"), phase("fetch"):
+            content = self.source.download_frame(self.client, url)
+        if content is None:
+            return None
+        with metrics.time("board_frame_decode_seconds"), phase("decode"):
+            frame = np.asarray(Image.open(BytesIO(content)).convert(mode))
+            if window is None:
+                window = np.s_[:, :]
+            ids = np.zeros(frame.shape[:2], dtype=np.uint8)
+            ids[window] = ColorMapper.index_image_lut(frame[window], colors)
+            changed = None
+            if mode == "RGBA":
+                changed = np.zeros(frame.shape[:2], dtype=bool)
+                changed[window] = frame[window][..., 3] > 0
+        return ids, changed, content
+
+    def apply_pending(self, ws):
+        # Apply the downloaded frames in the order they were received
+        while self.pending and self.pending[0][-1].done():
+            canvas_index, data, colors, region, received, future = (
+                self.pending.popleft()
+            )
+            frame = future.result()
+            if frame is not None and self.recorder:
+                self.recorder.frame(received, canvas_index, data, frame[2])
+            if frame is None or colors != self.colors or region != self.region:
+                continue  # gone or decoded with an outdated palette or region
+            kind = "full" if data["__typename"] == "FullFrameMessageData" else "diff"
+            with metrics.time("board_frame_composite_seconds", kind=kind):
+                if kind == "full":
+                    self.apply_full_frame(canvas_index, data, frame)
+                else:
+                    self.apply_diff_frame(ws, canvas_index, data, frame)
+            metrics.observe("board_frame_latency_seconds", time.time() - received)
+            metrics.inc("board_frames_total", kind=kind)
+
+    def frame_window(self, canvas_index, frame):
+        """
+        Part of the frame inside the region, as the slices of the frame,
+        the slices of the region buffer and the box in board coordinates.
+        Called with self.lock held.
+        """
+        dx, dy = self.canvas_offset(canvas_index)
+        box = intersect((dx, dy, dx + frame.shape[1], dy + frame.shape[0]), self.region)
+        if box is None:
+            return None
+        x0, y0 = self.region[:2]
+        source = np.s_[box[1] - dy : box[3] - dy, box[0] - dx : box[2] - dx]
+        target = np.s_[box[1] - y0 : box[3] - y0, box[0] - x0 : box[2] - x0]
+        return source, target, box
+
+    @phase("full_frame")
+    def apply_full_frame(self, canvas_index, data, frame):
+        ids, _, _ = frame
+        with self.lock:
+            self.timestamps[canvas_index] = data["timestamp"]
+            window = self.frame_window(canvas_index, ids)
+            if window:
+                source, target, box = window
+                self.board[target] = ids[source]
+                self.record_change(box)
+            missing = len(self.subscribed - self.timestamps.keys())
+        logger.debug("Canvas frames remaining: {}", missing)
+        if missing == 0:
+            self.ready.set()
+
+    @phase("diff_frame")
+    def apply_diff_frame(self, ws, canvas_index, data, frame):
+        last = self.timestamps.get(canvas_index)
+        if last is None:
+            return  # full frame still pending
+        if last != data["previousTimestamp"]:
+            # A diff went missing, resubscribe to receive a new full frame
+            logger.warning("Canvas {} out of sync, requesting full frame", canvas_index)
+            with self.lock:
+                del self.timestamps[canvas_index]
+            connect.unsubscribe(ws, connect.canvas_socket_id(canvas_index))
+            connect.subscribe_canvas(ws, canvas_index)
+            return
+
+        ids, changed, _ = frame
+        with self.lock:
+            self.timestamps[canvas_index] = data["currentTimestamp"]
+            window = self.frame_window(canvas_index, ids)
+            if window is None:
+                return
+            source, target, box = window
+
+            # Diff frames are transparent except for the changed pixels
+            changed = changed[source]
+            self.board[target][changed] = ids[source][changed]
+
+            # Shrink the recorded box to the changed pixels
+            rows = np.flatnonzero(changed.any(axis=1))
+            columns = np.flatnonzero(changed.any(axis=0))
+            if rows.size == 0:
+                self.record_change(None)
+                return
+            self.record_change(
+                (
+                    box[0] + int(columns[0]),
+                    box[1] + int(rows[0]),
+                    box[0] + int(columns[-1]) + 1,
+                    box[1] + int(rows[-1]) + 1,
+                )
+            )
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+import requests
+
+# Directory of the cached responses
+HTTP_CACHE_DIR = os.path.join("cache", "http")
+
+
+class HttpCache:
+    """
+    On-disk cache of GET responses revalidated with ETag / Last-Modified.
+    Decoded values are kept in memory, so a 304 costs no decoding at all.
+    Decoded values are shared between callers and must not be modified.
+    """
+
+    def __init__(self, directory=HTTP_CACHE_DIR):
+        self.directory = os.path.join(os.getcwd(), directory)
+        self.lock = threading.Lock()
+        self.decoded = {}  # (url, decoder) -> (validator, value)
+
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest())
+
+    def read_meta(self, url):
+        try:
+            with open(self.path(url) + ".json") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("url") == url else None
+
+    def write(self, url, meta, content):
+        os.makedirs(self.directory, exist_ok=True)
+        # body first, a meta file always points to a complete body
+        tmp = f"{self.path(url)}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, self.path(url))
+        with open(self.path(url) + ".json", "w") as f:
+            json.dump(meta, f)
+
+    def get(self, url, decode):
+        """
+        Returns decode(body) of the url, raises requests exceptions like
+        requests.get followed by raise_for_status.
+        """
+        meta = self.read_meta(url)
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = requests.get(url, headers=headers)
+        response.raise_for_status()
+
+        if response.status_code == 304 and meta:
+            validator = (meta.get("etag"), meta.get("last_modified"))
+            with self.lock:
+                cached = self.decoded.get((url, decode))
+            if cached and cached[0] == validator:
+                return cached[1]
+            try:
+                with open(self.path(url), "rb") as f:
+                    content = f.read()
+            except OSError:
+                # body went missing, fetch it again without validators
+                self.decoded.pop((url, decode), None)
+                os.remove(self.path(url) + ".json")
+                return self.get(url, decode)
+        else:
+            content = response.content
+            meta = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            validator = (meta["etag"], meta["last_modified"])
+            if any(validator):
+                self.write(url, meta, content)
+
+        value = decode(content)
+        with self.lock:
+            self.decoded[(url, decode)] = (validator, value)
+        return value
@@ -0,0 +1,55 @@
+import json
+import os
+from types import MappingProxyType
+
+
+class ConfigFile:
+    """
+    A json config that is only read again once the file changed, detected by
+    its modification time, size and inode. The parsed config is published as
+    a read-only snapshot that readers take without a lock. Values of a
+    snapshot are shared between threads and must not be modified.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.join(os.getcwd(), path)
+        if not os.path.exists(self.path):
+            exit(f"No {self.path} file found. Read the README")
+        self.signature = None
+        self.snapshot = MappingProxyType({})
+        self.reload()
+
+    def stat(self):
+        result = os.stat(self.path)
+        return result.st_mtime_ns, result.st_size, result.st_ino, result.st_dev
+
+    def reload(self):
+        """
+        Publishes the config again if the file changed and returns the
+        previous snapshot, returns None if it did not change. Raises
+        JSONDecodeError for a broken file, which is read again next time.
+        """
+        try:
+            signature = self.stat()
+        except OSError:
+            return None  # being replaced, the old config stays
+        if signature == self.signature:
+            return None
+        with open(self.path) as f:
+            config = json.load(f)
+        previous, self.snapshot = self.snapshot, MappingProxyType(config)
+        self.signature = signature
+        return previous
+
+
+def worker_changes(previous, config):
+    """
+    Workers added and removed between two config snapshots, as a dict of
+    name -> credentials and a list of names. A worker whose credentials
+    changed is in both.
+    """
+    old = previous.get("workers") or {}
+    new = config.get("workers") or {}
+    added = {name: worker for name, worker in new.items() if old.get(name) != worker}
+    removed = [name for name, worker in old.items() if new.get(name) != worker]
+    return added, removed
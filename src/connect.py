@@ -1,21 +1,44 @@
 import json
 import requests
 import time
-from io import BytesIO
 from http import HTTPStatus
 from websocket import create_connection
 from websocket._exceptions import WebSocketConnectionClosedException
 import ssl
-from PIL import Image
 from loguru import logger
 from bs4 import BeautifulSoup
 
 import src.proxy as proxy
 
+# Default endpoints, each can be replaced by the "endpoints" config
+ENDPOINTS = {
+    "query": "https://gql-realtime-2.reddit.com/query",
+    "realtime": "wss://gql-realtime-2.reddit.com/query",
+    "reddit": "https://www.reddit.com",
+    "new_reddit": "https://new.reddit.com",
+}
+
+# Seconds any other request to reddit may take, a hung request would
+# otherwise keep a scheduler thread busy for good
+REQUEST_TIMEOUT = 30
+# Concurrent frame downloads, and the pooled session they share
+FRAME_DOWNLOAD_WORKERS = 6
+# Seconds a frame download may take before the subscription is reset,
+# frames are applied in order so a hung download would stall all others
+FRAME_TIMEOUT = 30
+frame_session = requests.Session()
+frame_session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_maxsize=FRAME_DOWNLOAD_WORKERS)
+)
+
+
+def endpoint(self, name):
+    return self.config_get("endpoints", {}).get(name, ENDPOINTS[name])
+
 
 def set_pixel(self, coord, color_index, canvas_index, access_token):
     # ACCEPTS REDDIT API COORD
-    url = "https://gql-realtime-2.reddit.com/query"
+    url = endpoint(self, "query")
 
     payload = json.dumps(
         {
@@ -69,17 +92,18 @@ def set_pixel(self, coord, color_index, canvas_index, access_token):
         headers=headers,
         data=payload,
         proxies=proxy.get_random_proxy(self, username=None),
+        timeout=REQUEST_TIMEOUT,
     )
 
     return response
 
 
-def get_board(self, access_token_in):
-    logger.debug("Connecting and obtaining board images")
+def connect_realtime(self, access_token_in):
+    # Open the realtime websocket and wait for the connection_init acknowledgement
     while not self.stop_event.is_set():
         try:
             ws = create_connection(
-                "wss://gql-realtime-2.reddit.com/query",
+                endpoint(self, "realtime"),
                 origin="https://garlic-bread.reddit.com",
                 sslopt={"cert_reqs": ssl.CERT_NONE},
             )
@@ -89,6 +113,8 @@ def get_board(self, access_token_in):
                 "Failed to connect to websocket, trying again in 30 seconds..."
             )
             time.sleep(30)
+    else:
+        return None
 
     ws.send(
         json.dumps(
@@ -110,6 +136,10 @@ def get_board(self, access_token_in):
         if msg.startswith('{"type":"connection_ack"}'):
             logger.debug("Connected to WebSocket server")
             break
+    return ws
+
+
+def subscribe_configuration(ws):
     logger.debug("Obtaining Canvas information")
     ws.send(
         json.dumps(
@@ -163,134 +193,75 @@ def get_board(self, access_token_in):
         )
     )
 
-    while not self.stop_event.is_set():
-        canvas_payload = json.loads(ws.recv())
-        if canvas_payload["type"] == "data":
-            canvas_details = canvas_payload["payload"]["data"]["subscribe"]["data"]
-            logger.debug("Canvas config: {}", canvas_payload)
-            break
-
-    canvas_sockets = []
-
-    canvas_count = len(canvas_details["canvasConfigurations"])
 
-    # Update color map
-    colors = canvas_details["colorPalette"]["colors"]
-    colors = {color["hex"]: color["index"] for color in colors}
+# Canvas subscriptions use the socket ids following the configuration (id 1)
+def canvas_socket_id(canvas_index):
+    return str(2 + canvas_index)
 
-    for i in range(0, canvas_count):
-        canvas_sockets.append(2 + i)
-        logger.debug("Creating canvas socket {}", canvas_sockets[i])
 
-        ws.send(
-            json.dumps(
-                {
-                    "id": str(2 + i),
-                    "type": "start",
-                    "payload": {
-                        "variables": {
-                            "input": {
-                                "channel": {
-                                    "teamOwner": "GARLICBREAD",
-                                    "category": "CANVAS",
-                                    "tag": str(i),
-                                }
+def subscribe_canvas(ws, canvas_index):
+    logger.debug("Creating canvas socket {}", canvas_socket_id(canvas_index))
+    ws.send(
+        json.dumps(
+            {
+                "id": canvas_socket_id(canvas_index),
+                "type": "start",
+                "payload": {
+                    "variables": {
+                        "input": {
+                            "channel": {
+                                "teamOwner": "GARLICBREAD",
+                                "category": "CANVAS",
+                                "tag": str(canvas_index),
                             }
-                        },
-                        "extensions": {},
-                        "operationName": "replace",
-                        "query": """subscription replace($input: SubscribeInput!) {
-                            subscribe(input: $input) {
-                                id
-                                ... on BasicMessage {
-                                    data {
+                        }
+                    },
+                    "extensions": {},
+                    "operationName": "replace",
+                    "query": """subscription replace($input: SubscribeInput!) {
+                        subscribe(input: $input) {
+                            id
+                            ... on BasicMessage {
+                                data {
+                                    __typename
+                                    ... on FullFrameMessageData {
                                         __typename
-                                        ... on FullFrameMessageData {
-                                            __typename
-                                            name
-                                            timestamp
-                                        }
-                                        ... on DiffFrameMessageData {
-                                            __typename
-                                            name
-                                            currentTimestamp
-                                            previousTimestamp
-                                        }
+                                        name
+                                        timestamp
+                                    }
+                                    ... on DiffFrameMessageData {
+                                        __typename
+                                        name
+                                        currentTimestamp
+                                        previousTimestamp
                                     }
-                                    __typename
                                 }
                                 __typename
                             }
-                        }""",
-                    },
-                }
-            )
+                            __typename
+                        }
+                    }""",
+                },
+            }
         )
-
-    imgs = []
-    logger.debug("A total of {} canvas sockets opened", len(canvas_sockets))
-
-    while len(canvas_sockets) > 0:
-        temp = json.loads(ws.recv())
-        logger.debug("Waiting for WebSocket message")
-
-        if temp["type"] == "data":
-            logger.debug(f"Received WebSocket data type message")
-            msg = temp["payload"]["data"]["subscribe"]
-
-            if msg["data"]["__typename"] == "FullFrameMessageData":
-                logger.debug("Received full frame message")
-                img_id = int(temp["id"])
-                logger.debug("Image ID: {}", img_id)
-
-                if img_id in canvas_sockets:
-                    logger.debug("Getting image: {}", msg["data"]["name"])
-                    img = requests.get(
-                        msg["data"]["name"],
-                        stream=True,
-                        proxies=proxy.get_random_proxy(self, username=None),
-                    )
-                    if not img.status_code == 404:
-                        imgs.append(
-                            [
-                                img_id,
-                                Image.open(BytesIO(img.content)),
-                            ]
-                        )
-                        canvas_sockets.remove(img_id)
-                        logger.debug(
-                            "Canvas sockets remaining: {}", len(canvas_sockets)
-                        )
-                    else:
-                        logger.debug("Received wrong image")
-                        canvas_sockets.remove(img_id)
-
-    for i in range(0, canvas_count - 1):
-        ws.send(json.dumps({"id": str(2 + i), "type": "stop"}))
-
-    ws.close()
-
-    new_img_width = (
-        max(map(lambda x: x["dx"], canvas_details["canvasConfigurations"]))
-        + canvas_details["canvasWidth"]
     )
-    logger.debug("New image width: {}", new_img_width)
 
-    new_img_height = (
-        max(map(lambda x: x["dy"], canvas_details["canvasConfigurations"]))
-        + canvas_details["canvasHeight"]
-    )
-    logger.debug("New image height: {}", new_img_height)
 
-    new_img = Image.new("RGB", (new_img_width, new_img_height))
+def unsubscribe(ws, socket_id):
+    ws.send(json.dumps({"id": socket_id, "type": "stop"}))
 
-    for idx, img in enumerate(sorted(imgs, key=lambda x: x[0])):
-        logger.debug("Adding image (ID {}): {}", img[0], img[1])
-        dx_offset = int(canvas_details["canvasConfigurations"][idx]["dx"])
-        dy_offset = int(canvas_details["canvasConfigurations"][idx]["dy"])
-        new_img.paste(img[1], (dx_offset, dy_offset))
 
-    return new_img, colors
+def download_frame(self, url):
+    # Returns the frame image file, or None if the frame is gone
+    img = frame_session.get(
+        url,
+        proxies=proxy.get_random_proxy(self, username=None),
+        timeout=FRAME_TIMEOUT,
+    )
+    if img.status_code == 404:
+        logger.debug("Received wrong image")
+        return None
+    return img.content
 
 
 def login(self, username, password, index, current_time):
@@ -306,11 +277,12 @@ def login(self, username, password, index, current_time):
                 }
             )
 
-            client.get("https://www.reddit.com")
+            client.get(endpoint(self, "reddit"), timeout=REQUEST_TIMEOUT)
 
             r = client.get(
-                "https://www.reddit.com/login",
+                endpoint(self, "reddit") + "/login",
                 proxies=proxy.get_random_proxy(self, username),
+                timeout=REQUEST_TIMEOUT,
             )
             login_get_soup = BeautifulSoup(r.content, "html.parser")
             csrf_token = login_get_soup.find("input", {"name": "csrf_token"})["value"]
@@ -323,9 +295,10 @@ def login(self, username, password, index, current_time):
             }
 
             r = client.post(
-                "https://www.reddit.com/login",
+                endpoint(self, "reddit") + "/login",
                 data=data,
                 proxies=proxy.get_random_proxy(self, username),
+                timeout=REQUEST_TIMEOUT,
             )
             break
         except Exception:
@@ -345,8 +318,9 @@ def login(self, username, password, index, current_time):
     for _ in range(5):
         try:
             r = client.get(
-                "https://new.reddit.com/",
+                endpoint(self, "new_reddit") + "/",
                 proxies=proxy.get_random_proxy(self, username),
+                timeout=REQUEST_TIMEOUT,
             )
             data_str = (
                 BeautifulSoup(r.content, features="html.parser")
@@ -391,7 +365,7 @@ def login(self, username, password, index, current_time):
 def check(self, coord, color_index, canvas_index, user):
     logger.debug('Thread {}" Self-checking if placement went through', user)
 
-    url = "https://gql-realtime-2.reddit.com/query"
+    url = endpoint(self, "query")
     payload = json.dumps(
         {
             "operationName": "pixelHistory",
@@ -446,11 +420,13 @@ def check(self, coord, color_index, canvas_index, user):
         headers=headers,
         data=payload,
         proxies=proxy.get_random_proxy(self, username=None),
+        timeout=REQUEST_TIMEOUT,
     )
 
     try:
-        pixel_user = response.json()["data"]["act"]["data"][0]["data"]["userInfo"]
-        ["username"]
+        pixel_user = response.json()["data"]["act"]["data"][0]["data"]["userInfo"][
+            "username"
+        ]
 
         logger.debug("Thread {}: Pixel placed by {}", user, pixel_user)
     except Exception as e:
@@ -0,0 +1,264 @@
+import math
+from abc import ABC, abstractmethod
+import numpy as np
+
+# sRGB value to linear light for every 8 bit value
+LINEAR = np.arange(256, dtype=np.float64) / 255
+LINEAR = np.where(
+    LINEAR > 0.04045, ((LINEAR + 0.055) / 1.055) ** 2.4, LINEAR / 12.92
+).astype(np.float32)
+
+# Linear sRGB to XYZ relative to the D65 white point
+XYZ = (
+    np.array(
+        [
+            [0.4124564, 0.3575761, 0.1804375],
+            [0.2126729, 0.7151522, 0.0721750],
+            [0.0193339, 0.1191920, 0.9503041],
+        ]
+    )
+    / np.array([0.95047, 1.0, 1.08883])[:, None]
+).astype(np.float32)
+
+
+def xyz_to_lab(xyz: np.ndarray) -> np.ndarray:
+    # CIE L*a*b* of white point relative XYZ values, float32
+    f = np.cbrt(xyz)
+    linear = xyz <= (6 / 29) ** 3
+    f[linear] = xyz[linear] / (3 * (6 / 29) ** 2) + 4 / 29
+    lab = np.empty_like(f)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    return xyz_to_lab(LINEAR[rgb[..., :3]] @ XYZ.T)
+
+
+def lab_rows(start, stop):
+    # Lab of all colors with red values start to stop, as [r, g, b, channel]
+    green_blue = LINEAR[:, None, None] * XYZ[:, 1] + LINEAR[None, :, None] * XYZ[:, 2]
+    for r in range(start, stop):
+        yield xyz_to_lab(green_blue + LINEAR[r] * XYZ[:, 0])
+
+
+def ciede2000(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """
+    CIEDE2000 color difference of L*a*b* colors, following Sharma, Wu and
+    Dalal, "The CIEDE2000 Color-Difference Formula" (2005). Angles in radians.
+    """
+    L1, a1, b1 = np.moveaxis(lab1, -1, 0)
+    L2, a2, b2 = np.moveaxis(lab2, -1, 0)
+
+    C7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2) ** 7
+    G = 0.5 * (1 - np.sqrt(C7 / (C7 + np.float32(25**7))))
+    a1 = (1 + G) * a1
+    a2 = (1 + G) * a2
+    C1 = np.hypot(a1, b1)
+    C2 = np.hypot(a2, b2)
+    h1 = np.arctan2(b1, a1) % (2 * np.pi)
+    h2 = np.arctan2(b2, a2) % (2 * np.pi)
+    achromatic = C1 * C2 == 0
+
+    dL = L2 - L1
+    dC = C2 - C1
+    dh = h2 - h1
+    dh = np.where(dh > np.pi, dh - 2 * np.pi, np.where(dh < -np.pi, dh + 2 * np.pi, dh))
+    dh[achromatic] = 0
+    dH = 2 * np.sqrt(C1 * C2) * np.sin(dh / 2)
+
+    L = (L1 + L2) / 2 - 50
+    C = (C1 + C2) / 2
+    h = h1 + h2
+    h = np.where(
+        np.abs(h1 - h2) <= np.pi,
+        h / 2,
+        np.where(h < 2 * np.pi, h / 2 + np.pi, h / 2 - np.pi),
+    )
+    h = np.where(achromatic, h1 + h2, h)
+
+    T = (
+        1
+        - 0.17 * np.cos(h - math.radians(30))
+        + 0.24 * np.cos(2 * h)
+        + 0.32 * np.cos(3 * h + math.radians(6))
+        - 0.20 * np.cos(4 * h - math.radians(63))
+    )
+    theta = math.radians(30) * np.exp(
+        -(((h - math.radians(275)) / math.radians(25)) ** 2)
+    )
+    C7 = C**7
+    R_T = -2 * np.sqrt(C7 / (C7 + np.float32(25**7))) * np.sin(2 * theta)
+    dL = dL / (1 + 0.015 * L**2 / np.sqrt(20 + L**2))
+    dC = dC / (1 + 0.045 * C)
+    dH = dH / (1 + 0.015 * C * T)
+    return np.sqrt(dL**2 + dC**2 + dH**2 + R_T * dC * dH)
+
+
+class ColorMetric(ABC):
+    """
+    A difference between rgb colors, lower is closer. What only depends on
+    the palette is computed once per palette and kept.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.prepared = {}  # palette bytes -> prepare(palette)
+
+    def palette(self, colors: np.ndarray):
+        key = colors.astype(np.uint8).tobytes()
+        if key not in self.prepared:
+            self.prepared[key] = self.prepare(colors)
+        return self.prepared[key]
+
+    def prepare(self, colors: np.ndarray) -> dict:
+        # Tables of the (n, 3) uint8 palette, the table of distances between
+        # all palette colors is always part of it
+        return {"table": self.distance(colors[:, None], colors[None, :])}
+
+    def table(self, colors: np.ndarray) -> np.ndarray:
+        """Distance between every pair of palette indices, [index, index]."""
+        return self.palette(colors)["table"]
+
+    @abstractmethod
+    def distance(self, image: np.ndarray, target: np.ndarray) -> np.ndarray:
+        """Distance between rgb(a) arrays, broadcast against each other."""
+
+    def distances(self, image: np.ndarray, colors: np.ndarray) -> np.ndarray:
+        """Distance of an rgb(a) image to every palette color, [..., index]."""
+        dist = np.empty(image.shape[:-1] + (colors.shape[0],))
+        for i, color in enumerate(colors):
+            dist[..., i] = self.distance(image, color)
+        return dist
+
+    @abstractmethod
+    def nearest_rows(self, colors: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """Closest palette index of all colors with red values start to stop."""
+
+
+class Redmean(ColorMetric):
+    """
+    Redmean distance times 512 as int32, https://en.wikipedia.org/wiki/Color_difference
+    The scaled distance is an integer, ties resolve exactly the same way in
+    every computation of it.
+    """
+
+    name = "redmean"
+
+    def distance(self, image, target):
+        image = image[..., :3].astype(np.int32)
+        target = target[..., :3].astype(np.int32)
+        sum_r = image[..., 0] + target[..., 0]
+        delta = image - target
+        np.square(delta, out=delta)
+        dist = (1024 + sum_r) * delta[..., 0]
+        dist += 2048 * delta[..., 1]
+        dist += (1536 - sum_r) * delta[..., 2]
+        return dist
+
+    def prepare(self, colors):
+        prepared = super().prepare(colors)
+        colors = colors.astype(np.int32)
+        values = np.arange(256, dtype=np.int32)[:, None]
+        prepared["colors"] = colors
+        prepared["green"] = 2048 * (values - colors[:, 1]) ** 2
+        prepared["blue"] = (values - colors[:, 2]) ** 2  # weighted per red value
+        return prepared
+
+    def nearest_rows(self, colors, start, stop):
+        prepared = self.palette(colors)
+        colors, green, squares = (prepared[k] for k in ("colors", "green", "blue"))
+        lut = np.empty((stop - start, 256, 256), dtype=np.uint8)
+        for r in range(start, stop):
+            sum_r = r + colors[:, 0]
+            red = (1024 + sum_r) * (r - colors[:, 0]) ** 2
+            blue = (1536 - sum_r) * squares
+            lut[r - start] = np.argmin(
+                (red + green)[:, None, :] + blue[None, :, :], axis=-1
+            )
+        return lut
+
+
+class CIE76(ColorMetric):
+    """Euclidean distance in CIE L*a*b*, float32."""
+
+    name = "cie76"
+
+    def distance(self, image, target):
+        return self.lab_distance(rgb_to_lab(image), rgb_to_lab(target))
+
+    @staticmethod
+    def lab_distance(lab1, lab2):
+        delta = lab1 - lab2
+        return np.sqrt(np.einsum("...i,...i->...", delta, delta))
+
+    def distances(self, image, colors):
+        # The image is converted to Lab once, not once per palette color
+        lab = rgb_to_lab(image)
+        palette = self.palette(colors)["lab"]
+        dist = np.empty(image.shape[:-1] + (palette.shape[0],))
+        for i, color in enumerate(palette):
+            dist[..., i] = self.lab_distance(lab, color)
+        return dist
+
+    def prepare(self, colors):
+        lab = rgb_to_lab(colors)  # once, so the table is exactly 0 for equal colors
+        return {
+            "table": self.lab_distance(lab[:, None], lab[None, :]),
+            "lab": lab,
+            # |x - p|^2 = |x|^2 - 2 x.p + |p|^2, |x|^2 is the same for every p
+            "projection": -2 * lab.T,
+            "norms": np.einsum("ij,ij->i", lab, lab),
+        }
+
+    def nearest_rows(self, colors, start, stop):
+        prepared = self.palette(colors)
+        lut = np.empty((stop - start, 256, 256), dtype=np.uint8)
+        for i, lab in enumerate(lab_rows(start, stop)):
+            dist = lab @ prepared["projection"]
+            dist += prepared["norms"]
+            lut[i] = np.argmin(dist, axis=-1)
+        return lut
+
+
+class CIEDE2000(ColorMetric):
+    """CIEDE2000 in CIE L*a*b*, float32. Slow, its lookup table takes minutes."""
+
+    name = "ciede2000"
+
+    def distance(self, image, target):
+        return ciede2000(rgb_to_lab(image), rgb_to_lab(target))
+
+    def distances(self, image, colors):
+        # The image is converted to Lab once, not once per palette color
+        lab = rgb_to_lab(image)
+        palette = self.palette(colors)["lab"]
+        dist = np.empty(image.shape[:-1] + (palette.shape[0],))
+        for i, color in enumerate(palette):
+            dist[..., i] = ciede2000(lab, color)
+        return dist
+
+    def prepare(self, colors):
+        lab = rgb_to_lab(colors)  # once, so the table is exactly 0 for equal colors
+        return {"table": ciede2000(lab[:, None], lab[None, :]), "lab": lab}
+
+    def nearest_rows(self, colors, start, stop):
+        palette = self.palette(colors)["lab"]
+        lut = np.empty((stop - start, 256, 256), dtype=np.uint8)
+        for i, lab in enumerate(lab_rows(start, stop)):
+            for g in range(0, 256, 32):  # bounds the temporaries of ciede2000
+                dist = ciede2000(lab[g : g + 32, :, None], palette)
+                lut[i, g : g + 32] = np.argmin(dist, axis=-1)
+        return lut
+
+
+METRICS = {metric.name: metric for metric in (Redmean(), CIE76(), CIEDE2000())}
+
+
+def get_metric(name) -> ColorMetric:
+    if name not in METRICS:
+        raise KeyError(f"Unknown color metric {name}, use one of {list(METRICS)}")
+    return METRICS[name]
@@ -1,6 +1,60 @@
+import hashlib
+import os
+import threading
 import numpy as np
 from PIL import ImageColor
 
+from src.distance import get_metric
+
+# Directory of the on-disk palette lookup tables
+LUT_DIR = "cache"
+
+
+class Palette:
+    """
+    A palette compiled once from its {hex: color id} map.
+    Palette indices are the positions in the map, colors are matched as
+    packed 0xRRGGBB integers so whole arrays convert in one call.
+    """
+
+    def __init__(self, colors: dict):
+        self.colors = dict(colors)
+        self.rgb = np.array(
+            [ImageColor.getcolor(color_hex, "RGB") for color_hex in colors],
+            dtype=np.uint8,
+        ).reshape(-1, 3)
+        self.ids = np.array(list(colors.values()), dtype=np.int64)
+        self.rgb.setflags(write=False)
+        self.ids.setflags(write=False)
+
+        # sorted packed colors for searchsorted
+        keys = Palette.pack(self.rgb)
+        self.key_order = np.argsort(keys)
+        self.keys = keys[self.key_order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def pack(rgb: np.ndarray) -> np.ndarray:
+        rgb = np.asarray(rgb)
+        return (
+            rgb[..., 0].astype(np.uint32) << 16
+            | rgb[..., 1].astype(np.uint32) << 8
+            | rgb[..., 2].astype(np.uint32)
+        )
+
+    def rgb_to_index(self, rgb: np.ndarray) -> np.ndarray:
+        """Palette index of exact palette colors, -1 for other colors."""
+        keys = Palette.pack(rgb)
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[found] == keys, self.key_order[found], -1)[()]
+
+    def rgb_to_id(self, rgb: np.ndarray) -> np.ndarray:
+        """Color id of exact palette colors, -1 for other colors."""
+        index = self.rgb_to_index(rgb)
+        return np.where(index >= 0, self.ids[index], -1)[()]
+
 
 class ColorMapper:
     FULL_COLOR_MAP = {
@@ -38,6 +92,17 @@ class ColorMapper:
         "#FFFFFF": 31,  # white
     }
 
+    # (hex, color id) pairs -> compiled palette
+    PALETTES = {}
+
+    # palette hash (plus metric) -> memory-mapped lookup table
+    LUTS = {}
+    LUT_BUILDS = {}  # palette hash -> lock held while its table is built
+    LUT_LOCK = threading.Lock()  # guards LUT_BUILDS
+
+    # palette index of transparent template pixels
+    TRANSPARENT = 255
+
     # map of pixel color ids to verbose name (for debugging)
     FULL_NAME_MAP = {
         0: "Darkest Red",
@@ -74,19 +139,28 @@ class ColorMapper:
         31: "White",
     }
 
+    @staticmethod
+    def palette(colors: dict = None) -> Palette:
+        """Compiled palette of a {hex: color id} map, built once per palette."""
+        colors = ColorMapper.FULL_COLOR_MAP if colors is None else colors
+        key = tuple(colors.items())
+        palette = ColorMapper.PALETTES.get(key)
+        if palette is None:
+            palette = ColorMapper.PALETTES.setdefault(key, Palette(colors))
+        return palette
+
     @staticmethod
     def palette_to_rgb(palette: dict):
-        return np.array(
-            [ImageColor.getcolor(color_hex, "RGB") for color_hex in palette]
-        )
+        # int like it always was, the compiled palette keeps uint8 values
+        return ColorMapper.palette(palette).rgb.astype(int)
 
     @staticmethod
-    def rgb_to_name(rgb: np.ndarray):
-        return ColorMapper.color_id_to_name(ColorMapper.rgb_to_id(rgb))
+    def rgb_to_name(rgb: np.ndarray, colors: dict = None):
+        return ColorMapper.color_id_to_name(ColorMapper.rgb_to_id(rgb, colors))
 
     @staticmethod
-    def rgb_to_id(rgb: np.ndarray):
-        return ColorMapper.FULL_COLOR_MAP[ColorMapper.rgb_to_hex(rgb)]
+    def rgb_to_id(rgb: np.ndarray, colors: dict = None):
+        return ColorMapper.palette(colors).rgb_to_id(rgb)
 
     @staticmethod
     def rgb_to_hex(rgb: np.ndarray):
@@ -106,29 +180,130 @@ class ColorMapper:
         Calculate the redmean distance between two rgb colors
         https://en.wikipedia.org/wiki/Color_difference
         """
+        # exact, the redmean metric works on 512 times the distance in int32
+        return get_metric("redmean").distance(image, target) / 512
 
-        # convert to float to prevent overflow
-        image = image[...,:3].astype(float)
-        target = target[...,:3].astype(float)
-
-        mean_r = 0.5 * image[...,0] + 0.5 * target[...,0]
-        delta_rgb = image - target
-        weights = np.empty_like(delta_rgb)
-        weights[...,0] = 2 + mean_r/256
-        weights[...,1] = 4
-        weights[...,2] = 3 - mean_r/256
-        return np.einsum("...i,...i->...", weights, delta_rgb**2)
+    @staticmethod
+    def row_blocks(shape: tuple, pixel_bytes: int, max_memory: int = None):
+        """Slices along the first axis so each block needs at most max_memory."""
+        if max_memory is None:
+            yield slice(0, shape[0])
+            return
+        rows = max(1, int(max_memory // (pixel_bytes * max(shape[1], 1))))
+        for start in range(0, shape[0], rows):
+            yield slice(start, start + rows)
 
     @staticmethod
-    def correct_image(target_image: np.ndarray, colors: dict) -> np.ndarray:
+    def correct_image(
+        target_image: np.ndarray,
+        colors: dict,
+        max_memory: int = None,
+        metric: str = "redmean",
+    ) -> np.ndarray:
         image = np.empty_like(target_image)
         colors = ColorMapper.palette_to_rgb(colors)
-        correction_dist = np.empty(target_image.shape[:2] + (colors.shape[0],))
-
-        for i, color in enumerate(colors):
-            correction_dist[...,i] = ColorMapper.redmean_dist(target_image, color)
-        
-        ids = np.argmin(correction_dist, axis=-1)
-        image[...,:3] = colors[ids].astype(np.uint8)
-        image[...,3] = target_image[...,3]
+        metric = get_metric(metric)
+        # float64 distance to every color plus the metric temporaries
+        pixel_bytes = 8 * colors.shape[0] + 128
+
+        for rows in ColorMapper.row_blocks(target_image.shape, pixel_bytes, max_memory):
+            block = target_image[rows]
+            correction_dist = metric.distances(block, colors)
+            ids = np.argmin(correction_dist, axis=-1)
+            image[rows, ..., :3] = colors[ids]
+            del correction_dist  # freed before the next block is allocated
+        image[..., 3] = target_image[..., 3]
+        return image
+
+    @staticmethod
+    def palette_hash(colors: np.ndarray) -> str:
+        return hashlib.sha1(colors.astype(np.uint8).tobytes()).hexdigest()
+
+    @staticmethod
+    def build_lut(colors: np.ndarray, metric: str = "redmean") -> np.ndarray:
+        """
+        Index of the closest palette color for all 2^24 rgb values.
+        Ties resolve exactly like the metric does in correct_image.
+        """
+        return ColorMapper.build_lut_rows(colors, 0, 256, metric).reshape(-1)
+
+    @staticmethod
+    def build_lut_rows(
+        colors: np.ndarray, start: int, stop: int, metric: str = "redmean"
+    ) -> np.ndarray:
+        """Part of build_lut for the red values start to stop, as [r, g, b]."""
+        return get_metric(metric).nearest_rows(colors, start, stop)
+
+    @staticmethod
+    def load_lut(colors: np.ndarray, build=None, metric: str = "redmean") -> np.ndarray:
+        """
+        Lookup table for a palette, built once and memory-mapped from disk.
+        build(colors, metric) replaces build_lut, like the parallel backend's.
+        """
+        key = ColorMapper.palette_hash(colors)
+        if metric != "redmean":
+            key = f"{key}_{metric}"
+        lut = ColorMapper.LUTS.get(key)
+        if lut is not None:
+            return lut
+
+        # Only callers of the same table wait for its build
+        with ColorMapper.LUT_LOCK:
+            lock = ColorMapper.LUT_BUILDS.setdefault(key, threading.Lock())
+        with lock:
+            if key in ColorMapper.LUTS:
+                return ColorMapper.LUTS[key]
+
+            path = os.path.join(os.getcwd(), LUT_DIR, f"palette_{key}.lut")
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # write to a temporary file so a partial table is never loaded
+                (build or ColorMapper.build_lut)(colors, metric).tofile(path + ".tmp")
+                os.replace(path + ".tmp", path)
+
+            lut = np.memmap(path, dtype=np.uint8, mode="r", shape=(1 << 24,))
+            ColorMapper.LUTS[key] = lut
+            return lut
+
+    @staticmethod
+    def index_image_lut(
+        target_image: np.ndarray,
+        colors: dict,
+        max_memory: int = None,
+        metric: str = "redmean",
+    ) -> np.ndarray:
+        """Palette index of the color correct_image picks for every pixel."""
+        lut = ColorMapper.load_lut(ColorMapper.palette_to_rgb(colors), metric=metric)
+        # packed keys and their temporaries, the gathered index
+        pixel_bytes = 4 * 4 + 1
+
+        ids = np.empty(target_image.shape[:2], dtype=np.uint8)
+        for rows in ColorMapper.row_blocks(target_image.shape, pixel_bytes, max_memory):
+            ids[rows] = lut[Palette.pack(target_image[rows])]
+        return ids
+
+    @staticmethod
+    def index_template(
+        target_image: np.ndarray,
+        colors: dict,
+        max_memory: int = None,
+        metric: str = "redmean",
+    ) -> np.ndarray:
+        """Palette indices of an rgba template, TRANSPARENT where not opaque."""
+        ids = ColorMapper.index_image_lut(target_image, colors, max_memory, metric)
+        ids[target_image[..., 3] != 255] = ColorMapper.TRANSPARENT
+        return ids
+
+    @staticmethod
+    def correct_image_lut(
+        target_image: np.ndarray,
+        colors: dict,
+        max_memory: int = None,
+        metric: str = "redmean",
+    ) -> np.ndarray:
+        """Same result as correct_image, as a single gather from the lookup table."""
+        ids = ColorMapper.index_image_lut(target_image, colors, max_memory, metric)
+        image = np.empty_like(target_image)
+        image[..., :3] = ColorMapper.palette_to_rgb(colors)[ids]
+        image[..., 3] = target_image[..., 3]
         return image
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+
+# name -> (prometheus type, help), every metric has to be listed here
+METRICS = {
+    "board_refresh_seconds": (
+        "summary",
+        "Duration of a board and template refresh of the refresher thread.",
+    ),
+    "board_frame_fetch_seconds": ("summary", "Download time of a board frame."),
+    "board_frame_decode_seconds": (
+        "summary",
+        "Time to decode a board frame to palette indices.",
+    ),
+    "board_frame_composite_seconds": (
+        "summary",
+        "Time to write a decoded board frame into the board region.",
+    ),
+    "board_frame_latency_seconds": (
+        "summary",
+        "Time from receiving a frame message to applying the frame.",
+    ),
+    "wrong_pixels_update_seconds": (
+        "summary",
+        "Time to recompute the wrong pixels after a board change.",
+    ),
+    "template_reload_seconds": (
+        "summary",
+        "Time to download and merge the templates.",
+    ),
+    "set_pixel_seconds": ("summary", "Round trip time of a setPixel request."),
+    "board_frames_total": ("counter", "Board frames applied."),
+    "pixels_placed_total": ("counter", "Placement attempts by result."),
+    "wrong_pixels": ("gauge", "Pixels that differ from the template."),
+    "pool_lock_wait_seconds_total": (
+        "counter",
+        "Time spent waiting for the wrong pixel pool lock.",
+    ),
+    "pool_lock_acquisitions_total": (
+        "counter",
+        "Acquisitions of the wrong pixel pool lock.",
+    ),
+    "worker_wakeup_lateness_seconds": (
+        "gauge",
+        "How late the last wake-up of a worker after its cooldown was.",
+    ),
+}
+
+PREFIX = "place_"
+
+
+class Metrics:
+    """
+    Thread-safe registry of the client metrics.
+    Summaries keep the count, sum and maximum of their observations.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # (name, labels) -> value
+        self.summaries = {}  # (name, labels) -> [count, sum, max]
+
+    @staticmethod
+    def key(name, labels):
+        if name not in METRICS:
+            raise KeyError(f"Unknown metric {name}")
+        return name, tuple(sorted(labels.items()))
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[Metrics.key(name, labels)] = value
+
+    def inc(self, name, value=1, **labels):
+        key = Metrics.key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = Metrics.key(name, labels)
+        with self.lock:
+            summary = self.summaries.setdefault(key, [0, 0.0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        # Plain dict of every metric, for the json dump
+        with self.lock:
+            values = dict(self.values)
+            summaries = {key: list(summary) for key, summary in self.summaries.items()}
+        result = {}
+        for (name, labels), value in values.items():
+            result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), (count, total, maximum) in summaries.items():
+            result.setdefault(name, []).append(
+                {
+                    "labels": dict(labels),
+                    "count": count,
+                    "sum": total,
+                    "mean": total / count,
+                    "max": maximum,
+                }
+            )
+        return result
+
+    def prometheus(self):
+        # Prometheus text exposition format
+        lines = []
+        for name, samples in sorted(self.snapshot().items()):
+            kind, description = METRICS[name]
+            lines.append(f"# HELP {PREFIX}{name} {description}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for sample in samples:
+                labels = ",".join(f'{k}="{v}"' for k, v in sample["labels"].items())
+                labels = "{" + labels + "}" if labels else ""
+                if kind == "summary":
+                    lines.append(f"{PREFIX}{name}_count{labels} {sample['count']}")
+                    lines.append(f"{PREFIX}{name}_sum{labels} {sample['sum']}")
+                else:
+                    lines.append(f"{PREFIX}{name}{labels} {sample['value']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        # Prometheus endpoint on localhost, in a daemon thread
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logger.info("Serving metrics on http://127.0.0.1:{}/metrics", port)
+        return server
+
+    def dump(self, path):
+        with open(path + ".tmp", "w") as f:
+            json.dump({"timestamp": time.time(), "metrics": self.snapshot()}, f)
+        # replaced at once so readers never see a partial file
+        os.replace(path + ".tmp", path)
+
+
+# Shared by every thread of the client
+metrics = Metrics()
@@ -0,0 +1,449 @@
+import base64
+import hashlib
+import json
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+from src.mappings import ColorMapper
+
+# Magic string of the websocket handshake (RFC 6455)
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Number of frame images kept for download
+FRAME_HISTORY = 512
+
+# Subcanvases per row, like the reddit canvas
+CANVAS_COLUMNS = 3
+
+
+def dumps(message):
+    # connect_realtime matches the acknowledgement without whitespace
+    return json.dumps(message, separators=(",", ":"))
+
+
+class MockCanvas:
+    """
+    Board state of the mock server: subcanvases of palette indices which
+    publish full frames on subscription and diff frames of the pixels changed
+    since the last tick, by setPixel or by simulated players.
+    """
+
+    def __init__(self, canvases=6, canvas_size=1000, cooldown=300, noise=0, board=None):
+        self.lock = threading.Lock()
+        self.colors = ColorMapper.FULL_COLOR_MAP
+        self.palette = ColorMapper.palette(self.colors)
+        self.canvas_size = canvas_size
+        self.offsets = [
+            (canvas_size * (i % CANVAS_COLUMNS), canvas_size * (i // CANVAS_COLUMNS))
+            for i in range(canvases)
+        ]
+        width = canvas_size * min(canvases, CANVAS_COLUMNS)
+        height = canvas_size * -(-canvases // CANVAS_COLUMNS)
+        white = list(self.colors).index("#FFFFFF")
+        self.board = np.full((height, width), white, dtype=np.uint8)
+        if board is not None:
+            h, w = min(board.shape[0], height), min(board.shape[1], width)
+            self.board[:h, :w] = board[:h, :w]
+        self.changed = np.zeros(self.board.shape, dtype=bool)
+        self.timestamps = [0] * canvases  # timestamp of the last frame
+        self.cooldown = cooldown
+        self.noise = noise  # pixels set by simulated players per second
+
+        self.frames = OrderedDict()  # frame name -> png
+        self.frame_url = ""  # prefix of the frame names, set by the server
+        self.subscribers = []  # (connection, socket id, canvas index)
+        self.history = {}  # (x, y) -> (username, timestamp)
+        self.next_pixel = {}  # username -> timestamp when the cooldown ends
+        self.stats = dict.fromkeys(("placed", "rate_limited", "frames"), 0)
+
+    def config(self):
+        return {
+            "__typename": "ConfigurationMessageData",
+            "colorPalette": {
+                "colors": [
+                    {"hex": color_hex, "index": color_id}
+                    for color_hex, color_id in self.colors.items()
+                ]
+            },
+            "canvasConfigurations": [
+                {"index": i, "dx": dx, "dy": dy}
+                for i, (dx, dy) in enumerate(self.offsets)
+            ],
+            "canvasWidth": self.canvas_size,
+            "canvasHeight": self.canvas_size,
+        }
+
+    def window(self, canvas_index):
+        dx, dy = self.offsets[canvas_index]
+        return np.s_[dy : dy + self.canvas_size, dx : dx + self.canvas_size]
+
+    def timestamp(self, canvas_index):
+        # Strictly increasing per subcanvas, called with self.lock held
+        now = int(time.time() * 1000)
+        self.timestamps[canvas_index] = max(now, self.timestamps[canvas_index] + 1)
+        return self.timestamps[canvas_index]
+
+    def store_frame(self, image):
+        # Called with self.lock held, returns the name of the frame
+        buffer = BytesIO()
+        Image.fromarray(image, "RGBA").save(buffer, "PNG", compress_level=1)
+        name = secrets.token_hex(8)
+        self.frames[name] = buffer.getvalue()
+        while len(self.frames) > FRAME_HISTORY:
+            self.frames.popitem(last=False)
+        return f"{self.frame_url}{name}.png"
+
+    def full_frame(self, canvas_index):
+        # Called with self.lock held
+        ids = self.board[self.window(canvas_index)]
+        image = np.empty((*ids.shape, 4), dtype=np.uint8)
+        image[..., :3] = self.palette.rgb[ids]
+        image[..., 3] = 255
+        return {
+            "__typename": "FullFrameMessageData",
+            "name": self.store_frame(image),
+            "timestamp": self.timestamps[canvas_index],
+        }
+
+    def diff_frame(self, canvas_index):
+        # Called with self.lock held, None if nothing changed
+        window = self.window(canvas_index)
+        changed = self.changed[window]
+        if not changed.any():
+            return None
+        image = np.zeros((*changed.shape, 4), dtype=np.uint8)
+        image[changed, :3] = self.palette.rgb[self.board[window][changed]]
+        image[changed, 3] = 255
+        self.changed[window] = False
+        previous = self.timestamps[canvas_index]
+        return {
+            "__typename": "DiffFrameMessageData",
+            "name": self.store_frame(image),
+            "currentTimestamp": self.timestamp(canvas_index),
+            "previousTimestamp": previous,
+        }
+
+    def subscribe(self, connection, socket_id, canvas_index):
+        with self.lock:
+            self.subscribers.append((connection, socket_id, canvas_index))
+            data = self.full_frame(canvas_index)
+        connection.publish(socket_id, data)
+
+    def unsubscribe(self, connection, socket_id=None):
+        # Without socket id every subscription of the connection is removed
+        with self.lock:
+            self.subscribers = [
+                s
+                for s in self.subscribers
+                if s[0] is not connection or socket_id not in (None, s[1])
+            ]
+
+    def tick(self, seconds):
+        # Simulated players, then one diff frame per changed subcanvas
+        with self.lock:
+            count = np.random.poisson(self.noise * seconds)
+            ys = np.random.randint(0, self.board.shape[0], count)
+            xs = np.random.randint(0, self.board.shape[1], count)
+            self.board[ys, xs] = np.random.randint(0, len(self.palette), count)
+            self.changed[ys, xs] = True
+
+            frames = {}
+            for i in range(len(self.offsets)):
+                data = self.diff_frame(i)
+                if data:
+                    frames[i] = data
+            subscribers = [s for s in self.subscribers if s[2] in frames]
+        for connection, socket_id, canvas_index in subscribers:
+            connection.publish(socket_id, frames[canvas_index])
+
+    def set_pixel(self, username, pixel):
+        """
+        Response of a setPixel mutation, the pixel is placed unless the user
+        is still on cooldown.
+        """
+        canvas_index = pixel["canvasIndex"]
+        x, y = pixel["coordinate"]["x"], pixel["coordinate"]["y"]
+        if not (
+            0 <= canvas_index < len(self.offsets)
+            and 0 <= x < self.canvas_size
+            and 0 <= y < self.canvas_size
+            and pixel["colorIndex"] in self.colors.values()
+        ):
+            return {"data": None, "errors": [{"message": "invalid pixel"}]}
+
+        now = time.time()
+        with self.lock:
+            if self.next_pixel.get(username, 0) > now:
+                self.stats["rate_limited"] += 1
+                next_time = self.next_pixel[username]
+                return {
+                    "data": None,
+                    "errors": [
+                        {
+                            "message": "rate limited",
+                            "extensions": {"nextAvailablePixelTs": next_time * 1000},
+                        }
+                    ],
+                }
+            dx, dy = self.offsets[canvas_index]
+            color = list(self.colors.values()).index(pixel["colorIndex"])
+            self.board[dy + y, dx + x] = color
+            self.changed[dy + y, dx + x] = True
+            self.history[(dx + x, dy + y)] = (username, now)
+            self.next_pixel[username] = now + self.cooldown
+            self.stats["placed"] += 1
+        return self.act(
+            {
+                "__typename": "GetUserCooldownResponseMessageData",
+                "nextAvailablePixelTimestamp": (now + self.cooldown) * 1000,
+            }
+        )
+
+    def pixel_history(self, pixel):
+        dx, dy = self.offsets[pixel["canvasIndex"]]
+        position = (dx + pixel["coordinate"]["x"], dy + pixel["coordinate"]["y"])
+        with self.lock:
+            username, timestamp = self.history.get(position, (None, 0))
+        return self.act(
+            {
+                "__typename": "GetTileHistoryResponseMessageData",
+                "lastModifiedTimestamp": timestamp * 1000,
+                "userInfo": username and {"userID": username, "username": username},
+            }
+        )
+
+    @staticmethod
+    def act(data):
+        return {"data": {"act": {"data": [{"id": "mock", "data": data}]}}}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Serves the login pages, the query endpoint, the realtime websocket,
+    frame images and static files (for template manifests and images).
+    """
+
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        logger.debug("Mock: " + format, *args)
+
+    def respond(self, status, body=b"", content_type="text/html", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            self.websocket()
+        elif path == "/login":
+            self.respond(200, b'<input name="csrf_token" value="mock">')
+        elif path == "/":
+            self.session()
+        elif path.startswith("/frames/"):
+            canvas = self.server.canvas
+            with canvas.lock:
+                frame = canvas.frames.get(path[len("/frames/") : -len(".png")])
+                canvas.stats["frames"] += frame is not None
+            if frame is None:
+                self.respond(404)
+            else:
+                self.respond(200, frame, "image/png")
+        elif path.startswith("/files/"):
+            self.static(path[len("/files/") :])
+        else:
+            self.respond(404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlsplit(self.path).path
+        if path == "/login":
+            username = parse_qs(body.decode()).get("username", ["anonymous"])[0]
+            self.respond(200, headers=[("Set-Cookie", f"mock_user={username}")])
+        elif path == "/query":
+            self.query(json.loads(body))
+        else:
+            self.respond(404)
+
+    def session(self):
+        # Page with the access token of the logged in user
+        cookie = self.headers.get("Cookie", "")
+        cookies = dict(c.strip().split("=", 1) for c in cookie.split(";") if "=" in c)
+        username = cookies.get("mock_user", "anonymous")
+        token = f"{username}.{secrets.token_hex(8)}"
+        with self.server.lock:
+            self.server.tokens[token] = username
+        data = {"user": {"session": {"accessToken": token, "expiresIn": 3600}}}
+        body = f'<script id="data">window.__r = {dumps(data)};</script>'
+        self.respond(200, body.encode())
+
+    def query(self, request):
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        with self.server.lock:
+            username = self.server.tokens.get(token)
+        pixel = request["variables"]["input"]["PixelMessageData"]
+        if username is None:
+            response = {"data": None, "errors": [{"message": "unauthorized"}]}
+        elif request["operationName"] == "setPixel":
+            response = self.server.canvas.set_pixel(username, pixel)
+        elif request["operationName"] == "pixelHistory":
+            response = self.server.canvas.pixel_history(pixel)
+        else:
+            response = {"data": None, "errors": [{"message": "unknown operation"}]}
+        self.respond(200, dumps(response).encode(), "application/json")
+
+    def static(self, name):
+        root = os.path.realpath(self.server.files)
+        path = os.path.realpath(os.path.join(root, name))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            self.respond(404)
+            return
+        with open(path, "rb") as f:
+            body = f.read()
+        content_type = "image/png" if path.endswith(".png") else "application/json"
+        self.respond(200, body, content_type)
+
+    def websocket(self):
+        key = self.headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID
+        accept = base64.b64encode(hashlib.sha1(key.encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        connection = MockConnection(self)
+        try:
+            connection.serve()
+        finally:
+            self.server.canvas.unsubscribe(connection)
+            self.close_connection = True
+
+
+class MockConnection:
+    """One realtime websocket, speaking the graphql-ws protocol of reddit."""
+
+    def __init__(self, handler: MockHandler):
+        self.handler = handler
+        self.canvas = handler.server.canvas
+        self.send_lock = threading.Lock()
+
+    def read(self, size):
+        data = self.handler.rfile.read(size)
+        if len(data) < size:
+            raise ConnectionError("websocket closed")
+        return data
+
+    def recv(self):
+        # Text of the next message, None once the client closes
+        message = b""
+        while True:
+            head = self.read(2)
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.read(8))[0]
+            mask = self.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+            payload = np.frombuffer(self.read(length), dtype=np.uint8)
+            payload = payload ^ np.resize(np.frombuffer(mask, np.uint8), length)
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self.send(payload.tobytes(), 0xA)
+            elif opcode in (0x0, 0x1, 0x2):
+                message += payload.tobytes()
+                if head[0] & 0x80:
+                    return message.decode()
+
+    def send(self, payload: bytes, opcode=0x1):
+        length = len(payload)
+        if length < 126:
+            head = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 2**16:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self.send_lock:
+            self.handler.wfile.write(head + payload)
+            self.handler.wfile.flush()
+
+    def publish(self, socket_id, data):
+        message = {
+            "id": socket_id,
+            "type": "data",
+            "payload": {"data": {"subscribe": {"id": socket_id, "data": data}}},
+        }
+        try:
+            self.send(dumps(message).encode())
+        except OSError:
+            pass  # closed, the handler thread removes the subscriptions
+
+    def serve(self):
+        while True:
+            try:
+                message = self.recv()
+            except (ConnectionError, OSError):
+                return
+            if message is None:
+                return
+            message = json.loads(message)
+            if message["type"] == "connection_init":
+                self.send(dumps({"type": "connection_ack"}).encode())
+            elif message["type"] == "start":
+                channel = message["payload"]["variables"]["input"]["channel"]
+                if channel["category"] == "CONFIG":
+                    self.publish(message["id"], self.canvas.config())
+                else:
+                    canvas_index = int(channel["tag"])
+                    self.canvas.subscribe(self, message["id"], canvas_index)
+            elif message["type"] == "stop":
+                self.canvas.unsubscribe(self, message["id"])
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the reddit login, query and realtime endpoints.
+    Point the "endpoints" config at it, see mock_server.py.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, canvas: MockCanvas, files=".", tick=1):
+        super().__init__(address, MockHandler)
+        self.canvas = canvas
+        self.canvas.frame_url = "http://{}:{}/frames/".format(*self.server_address)
+        self.files = files  # directory served below /files/
+        self.tick = tick  # seconds between diff frames
+        self.lock = threading.Lock()
+        self.tokens = {}  # access token -> username
+        self.stop_event = threading.Event()
+
+    def run_ticks(self):
+        while not self.stop_event.wait(self.tick):
+            self.canvas.tick(self.tick)
+
+    def serve(self):
+        threading.Thread(target=self.run_ticks, daemon=True).start()
+        try:
+            self.serve_forever()
+        finally:
+            self.stop_event.set()
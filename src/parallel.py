@@ -0,0 +1,166 @@
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+from src.mappings import ColorMapper
+
+# Tasks per worker process, more than one evens out bands of unequal cost
+BANDS_PER_WORKER = 4
+
+
+class SharedArray:
+    """
+    A numpy array in a shared memory block. The process that creates it
+    owns the block, workers attach to it by name through its spec.
+    """
+
+    def __init__(self, shape, dtype, name=None):
+        dtype = np.dtype(dtype)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(
+            name=name,
+            create=self.owner,
+            size=max(int(np.prod(shape)) * dtype.itemsize, 1),
+        )
+        self.array = np.ndarray(shape, dtype, buffer=self.shm.buf)
+        self.spec = (tuple(shape), dtype.str, self.shm.name)
+
+    @staticmethod
+    def copy(array: np.ndarray):
+        shared = SharedArray(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    def close(self):
+        del self.array  # the block can't be closed while the array exists
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_band(task, specs, boxes, *args):
+    # Runs in a worker, task(*arrays, box, *args) for every box
+    shared = [SharedArray(*spec) for spec in specs]
+    try:
+        for box in boxes:
+            task(*(s.array for s in shared), box, *args)
+    finally:
+        for s in shared:
+            s.close()
+
+
+def index_band(image, ids, box, colors, max_memory, metric):
+    x0, y0, x1, y1 = box
+    ids[x0:x1, y0:y1] = ColorMapper.index_template(
+        image[x0:x1, y0:y1], colors, max_memory, metric
+    )
+
+
+def correct_band(image, corrected, box, colors, max_memory, metric):
+    x0, y0, x1, y1 = box
+    corrected[x0:x1, y0:y1] = ColorMapper.correct_image(
+        image[x0:x1, y0:y1], colors, max_memory, metric
+    )
+
+
+def lut_band(lut, box, colors, metric):
+    start, _, stop, _ = box
+    lut[start:stop] = ColorMapper.build_lut_rows(colors, start, stop, metric)
+
+
+class ParallelBackend:
+    """
+    Pool of worker processes for the color correction, free of the GIL.
+    Inputs are copied into shared memory once, the workers attach to it and
+    write their bands of the result straight into a shared output, no array
+    is pickled between processes. Bands are rows of the first axis, or the
+    given (x0, y0, x1, y1) boxes like the occupied tiles of a template.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            # ctrl+c is handled by the main process
+            initializer=signal.signal,
+            initargs=(signal.SIGINT, signal.SIG_IGN),
+        )
+
+    def bands(self, shape):
+        rows = max(1, -(-shape[0] // (self.workers * BANDS_PER_WORKER)))
+        return [
+            (x, 0, min(x + rows, shape[0]), shape[1]) for x in range(0, shape[0], rows)
+        ]
+
+    def run(self, task, arrays, boxes, *args):
+        # Boxes are dealt out round robin, a task per band
+        tasks = self.workers * BANDS_PER_WORKER
+        specs = [array.spec for array in arrays]
+        futures = [
+            self.executor.submit(run_band, task, specs, boxes[i::tasks], *args)
+            for i in range(min(tasks, len(boxes)))
+        ]
+        for future in futures:
+            future.result()
+
+    def build_lut(self, colors: np.ndarray, metric: str = "redmean") -> np.ndarray:
+        """ColorMapper.build_lut, the red values split across the workers."""
+        with SharedArray((256, 256, 256), np.uint8) as lut:
+            self.run(lut_band, [lut], self.bands((256, 1)), colors, metric)
+            return lut.array.reshape(-1).copy()
+
+    def index_template(
+        self,
+        image: np.ndarray,
+        colors: dict,
+        boxes=None,
+        max_memory: int = None,
+        metric: str = "redmean",
+    ) -> np.ndarray:
+        """
+        ColorMapper.index_template of the given boxes, TRANSPARENT elsewhere.
+        max_memory applies to every worker.
+        """
+        # built here once, the workers only map it
+        ColorMapper.load_lut(ColorMapper.palette_to_rgb(colors), self.build_lut, metric)
+        boxes = self.bands(image.shape) if boxes is None else boxes
+        with SharedArray.copy(image) as shared, SharedArray(
+            image.shape[:2], np.uint8
+        ) as ids:
+            ids.array.fill(ColorMapper.TRANSPARENT)
+            self.run(index_band, [shared, ids], boxes, colors, max_memory, metric)
+            return ids.array.copy()
+
+    def correct_image(
+        self,
+        image: np.ndarray,
+        colors: dict,
+        max_memory: int = None,
+        metric: str = "redmean",
+    ) -> np.ndarray:
+        """ColorMapper.correct_image, max_memory applies to every worker."""
+        with SharedArray.copy(image) as shared, SharedArray(
+            image.shape, image.dtype
+        ) as corrected:
+            self.run(
+                correct_band,
+                [shared, corrected],
+                self.bands(image.shape),
+                colors,
+                max_memory,
+                metric,
+            )
+            return corrected.array.copy()
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,165 @@
+import heapq
+import time
+import numpy as np
+
+from src.distance import get_metric
+from src.mappings import ColorMapper
+from src.profiler import phase
+
+
+def mismatch(board: np.ndarray, template: np.ndarray) -> np.ndarray:
+    # Opaque template pixels whose palette index differs from the board
+    return (template != ColorMapper.TRANSPARENT) & (template != board)
+
+
+# Priority functions get the pool and the coordinates of newly wrong pixels
+# and return one value per pixel, lower values are placed first
+def distance_priority(pool, coords, board, template):
+    # Pixels furthest from their target color first
+    return -pool.distances[
+        board[coords[:, 0], coords[:, 1]], template[coords[:, 0], coords[:, 1]]
+    ]
+
+
+def template_priority(pool, coords, board, template):
+    # Pixels of the templates listed first first
+    if pool.layers is None:
+        return np.zeros(coords.shape[0])
+    return pool.layers[coords[:, 0], coords[:, 1]]
+
+
+def age_priority(pool, coords, board, template):
+    # Pixels that have been wrong the longest first
+    return np.full(coords.shape[0], time.time())
+
+
+PRIORITIES = {
+    "distance": distance_priority,
+    "template": template_priority,
+    "age": age_priority,
+}
+
+
+class WorkPool:
+    """
+    Persistent pool of wrong pixels (cropped template relative position).
+    Pixels are kept in a heap ordered by the priority functions, ties are
+    broken by a random number. A pixel leaves the heap lazily: it is cleared
+    from wrong and the stale heap entry is skipped when popped. Every time a
+    pixel is queued its generation is bumped, so entries of an earlier
+    queueing of the same pixel are skipped too.
+    """
+
+    def __init__(
+        self,
+        shape,
+        palette: np.ndarray,
+        priorities=(),
+        layers: np.ndarray = None,
+        metric: str = "redmean",
+    ):
+        self.palette = palette  # rgb values of the palette indices
+        # color distance between every pair of palette indices
+        self.distances = get_metric(metric).table(palette)
+        self.priorities = [PRIORITIES[name] for name in priorities]
+        self.layers = layers  # index of the template each pixel comes from
+        self.wrong = np.zeros(shape, dtype=bool)
+        # times each pixel was queued, 4 bytes a pixel instead of a float key
+        self.generations = np.zeros(shape, dtype=np.uint32)
+        self.heap = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def entries(self, coords, board, template):
+        # Heap entries (*priorities, tie-break, generation, x, y) for the given
+        # pixels, coords must not repeat a pixel
+        self.generations[coords[:, 0], coords[:, 1]] += 1
+        generations = self.generations[coords[:, 0], coords[:, 1]]
+        keys = np.random.random(coords.shape[0])
+        columns = [f(self, coords, board, template) for f in self.priorities]
+        return list(
+            zip(
+                *(c.tolist() for c in columns),
+                keys.tolist(),
+                generations.tolist(),
+                *coords.T.tolist(),
+            )
+        )
+
+    def queued(self, entry):
+        # Whether a heap entry is the latest queueing of a still wrong pixel
+        *_, generation, x, y = entry
+        return self.wrong[x, y] and self.generations[x, y] == generation
+
+    @phase("rebuild")
+    def rebuild(self, board: np.ndarray, template: np.ndarray, wrong=None, boxes=None):
+        # Only the (x0, y0, x1, y1) boxes are compared, the whole arrays if None
+        # wrong restores a saved pool instead of comparing board and template
+        if wrong is not None:
+            self.wrong = np.array(wrong)
+            boxes = [(0, 0, *self.wrong.shape)]
+        else:
+            self.wrong = np.zeros(board.shape, dtype=bool)
+            if boxes is None:
+                boxes = [(0, 0, *board.shape)]
+            for x0, y0, x1, y1 in boxes:
+                self.wrong[x0:x1, y0:y1] = mismatch(
+                    board[x0:x1, y0:y1], template[x0:x1, y0:y1]
+                )
+        self.generations = np.zeros(self.wrong.shape, dtype=np.uint32)
+
+        coords = np.concatenate(
+            [np.empty((0, 2), dtype=np.intp)]
+            + [
+                np.argwhere(self.wrong[x0:x1, y0:y1]) + (x0, y0)
+                for x0, y0, x1, y1 in boxes
+            ]
+        )
+        self.heap = self.entries(coords, board, template)
+        heapq.heapify(self.heap)
+        self.count = coords.shape[0]
+
+    @phase("pool_update")
+    def update(self, board: np.ndarray, template: np.ndarray, box):
+        # Recompute the pixels inside box = (x0, y0, x1, y1) only
+        x0, y0, x1, y1 = box
+        wrong = mismatch(board[x0:x1, y0:y1], template[x0:x1, y0:y1])
+        was_wrong = self.wrong[x0:x1, y0:y1]
+
+        removed = np.count_nonzero(was_wrong & ~wrong)
+        added = np.argwhere(wrong & ~was_wrong) + (x0, y0)
+        for entry in self.entries(added, board, template):
+            heapq.heappush(self.heap, entry)
+
+        self.wrong[x0:x1, y0:y1] = wrong
+        self.count += added.shape[0] - removed
+
+        # Drop stale entries once they outnumber the queued pixels
+        if len(self.heap) > 2 * self.count + 1024:
+            self.heap = [e for e in self.heap if self.queued(e)]
+            heapq.heapify(self.heap)
+
+    def requeue(self, coord, board: np.ndarray, template: np.ndarray):
+        # Puts a popped pixel back after a failed placement, unless the board
+        # shows it correct or an update queued it again in the meantime
+        x, y = coord
+        if not (0 <= x < self.wrong.shape[0] and 0 <= y < self.wrong.shape[1]):
+            return  # the template moved since it was popped
+        if self.wrong[x, y] or not mismatch(board[x, y], template[x, y]):
+            return
+        self.wrong[x, y] = True
+        heapq.heappush(self.heap, self.entries(np.array([(x, y)]), board, template)[0])
+        self.count += 1
+
+    def pop(self):
+        # Returns the coordinate of the next wrong pixel, None if there is none
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if self.queued(entry):
+                x, y = entry[-2:]
+                self.wrong[x, y] = False
+                self.count -= 1
+                return np.array((x, y))
+        return None
@@ -1,24 +1,48 @@
 import numpy as np
 import time
 import threading
+from functools import partial
+from typing import NamedTuple
 from loguru import logger
 from json import JSONDecodeError
-from PIL import Image
 
-from src.mappings import ColorMapper
+from src.board import BoardSubscriber
+from src.cache import HttpCache
+from src.config import ConfigFile, worker_changes
+from src.distance import get_metric
+from src.mappings import ColorMapper, Palette
+from src.metrics import metrics
+from src.parallel import ParallelBackend
+from src.profiler import phase
+from src.pixels import WorkPool
+from src.scheduler import Scheduler
+from src.tiles import Tiles
+import src.artifacts as artifacts
+import src.recording as recording
+import src.warmstart as warmstart
 import src.proxy as proxy
 import src.utils as utils
 import src.connect as connect
 
 
+class Snapshot(NamedTuple):
+    # Published by the refresher, workers only read the latest one
+    # Template and palette are never written once published, the pool and
+    # the board change in place, both only under pool_lock
+    coord: np.ndarray
+    template: np.ndarray  # palette indices, TRANSPARENT outside the template
+    board: np.ndarray  # palette indices
+    pool: WorkPool
+    palette: Palette
+
+
 class PlaceClient:
     def __init__(self, config_path, canvas_path):
         self.logger = logger
         logger.add("logs/{time}.log", rotation="1 day")
 
         # Thread monitoring
-        self.update_lock = threading.Lock()
-        self.config_lock = threading.Lock()
+        self.pool_lock = utils.TimedLock()  # guards popping and updating wrong pixels
         self.stop_event = threading.Event()
         self.board_outdated = threading.Event()
         self.template_outdated = threading.Event()
@@ -26,7 +50,7 @@ class PlaceClient:
         # Data
         self.config_path = config_path
         self.canvas_path = canvas_path
-        self.config = utils.get_json_data(self, self.config_path)
+        self.config_file = ConfigFile(self.config_path)
         self.canvas = utils.get_json_data(self, self.canvas_path)
 
         proxy.Init(self)
@@ -35,133 +59,317 @@ class PlaceClient:
         self.access_tokens = {}
         self.access_token_expires_at_timestamp = {}
 
-        # Load template
-        data = utils.load_template_data(self)
-        if not data:
-            exit(1)  # exit if template is empty
-        coord, template = data
-
-        # Template information
-        self.coord = coord + np.array(self.canvas["offset"]["template_api"])
-        self.color_palette = ColorMapper.FULL_COLOR_MAP
-        self.template: np.ndarray = ColorMapper.correct_image(
-            np.swapaxes(template, 0, 1), self.color_palette
-        )
+        # Worker processes for the color correction
+        workers = self.config_get("parallel_workers")
+        self.parallel = ParallelBackend(workers) if workers else None
+        self.color_metric = self.config_get("color_metric", "redmean")
+        get_metric(self.color_metric)  # fail early on an unknown name
+
+        # Load template, from the state saved by an earlier run if there is one
+        # The refresher reloads the template in the background
+        self.http_cache = HttpCache()
+        state = warmstart.load(self)
+        if state:
+            logger.info(
+                "Warm start: Using the state saved {:.0f}s ago",
+                time.time() - state["saved_at"],
+            )
+            self.coord = state["coord"]
+            self.template_layers = state["template_layers"]
+            self.template_image = state["template_image"]
+            self.tiles = Tiles(self.template_image)
+            self.color_palette = state["palette"]
+            self.template: np.ndarray = state["template"]
+            self.template_outdated.set()
+        else:
+            with metrics.time("template_reload_seconds"):
+                data = utils.load_template_data(self)
+            if not data:
+                exit(1)  # exit if template is empty
+            coord, template, layers = data
+
+            # Template information
+            self.coord = coord + np.array(self.canvas["offset"]["template_api"])
+            self.template_layers = np.swapaxes(layers, 0, 1)
+            self.template_image = np.swapaxes(template, 0, 1)  # rgba before correction
+            self.tiles = Tiles(self.template_image)
+            self.color_palette = ColorMapper.FULL_COLOR_MAP
+            self.template: np.ndarray = self.tiles.index_template(
+                self.template_image,
+                self.color_palette,
+                self.correction_memory(),
+                self.parallel,
+                self.color_metric,
+            )
 
         # Board information
+        self.board_subscriber = BoardSubscriber(self, *self.board_source())
+        self.board_version = -1  # version of the subscriber board self.board shows
         self.board: np.ndarray = None
-        self.wrong_pixels: list = []
+        self.wrong_pixels = self.new_work_pool()
+        self.snapshot: Snapshot = None
+        self.next_warm_save = time.time() + self.config_get("warm_start_interval", 60)
+
+        # Workers start on the saved board until the subscriber has a new one
+        if state and state["board"] is not None:
+            self.board = state["board"]
+            self.wrong_pixels.rebuild(self.board, self.template, state["wrong"])
+            metrics.set("wrong_pixels", len(self.wrong_pixels))
+            self.snapshot = Snapshot(
+                self.coord,
+                self.template,
+                self.board,
+                self.wrong_pixels,
+                ColorMapper.palette(self.color_palette),
+            )
+
+        # Debug images
+        self.artifacts = artifacts.ArtifactWriter(
+            self.stop_event, lambda: self.config_get("debug_artifact_interval", 60)
+        )
+
+    # Publish board and template snapshots for the workers until stopped
+    def refresh(self):
+        while not self.stop_event.is_set():
+            if not self.board_outdated.wait(timeout=1):
+                continue
+            if not self.access_tokens:
+                # the board subscription needs a logged in worker, the event
+                # stays set so wait here instead
+                self.stop_event.wait(1)
+                continue
+            try:
+                with metrics.time("board_refresh_seconds"):
+                    self.update()
+            except Exception:
+                logger.exception("Refresher: Failed to update")
 
     # Update board, templates and canvas offsets
-    # Returns position, size and template image
-    def update(self, username):
+    # Only called by the refresher thread
+    @phase("update")
+    def update(self):
         board_changed = False
         colors_changed = False
         template_changed = False
 
-        # Update board image if outdated
-        if self.board_outdated.is_set() or self.board is None:
-            self.board_outdated.clear()
-            logger.debug("Thread {}: Updating board image", username)
-            board, colors = connect.get_board(self, self.access_tokens[username])
-            if self.color_palette != colors:
-                self.color_palette = colors
-                colors_changed = True
-            board_changed = True
+        # A new color metric changes the corrected template and the priorities
+        metric = self.config_get("color_metric", "redmean")
+        if metric != self.color_metric:
+            get_metric(metric)  # raises for unknown names, the old one stays
+            logger.info("Refresher: Switching to the {} color metric", metric)
+            self.color_metric = metric
+            template_changed = True
 
         # Update template image and canvas offsets if outdated
         if self.template_outdated.is_set():
             self.template_outdated.clear()
-            logger.debug(
-                "Thread {}: Updating template image and canvas offsets", username
-            )
-            data = utils.load_template_data(self)
+            logger.debug("Refresher: Updating template image and canvas offsets")
+            # the canvas first, templates are clipped to its bounds
+            self.canvas = utils.get_json_data(self, self.canvas_path)
+            with metrics.time("template_reload_seconds"), phase("template"):
+                data = utils.load_template_data(self)
             if not data:
                 return  # skip updating
-            coord, template = data
-            self.canvas = utils.get_json_data(self, self.canvas_path)
+            coord, template, layers = data
             self.coord = coord + np.array(self.canvas["offset"]["template_api"])
-            self.template = np.swapaxes(template, 0, 1)
+            self.template_image = np.swapaxes(template, 0, 1)
+            self.template_layers = np.swapaxes(layers, 0, 1)
+            self.tiles = Tiles(self.template_image)
             template_changed = True
 
+        # Only the part of the board under the template is kept
+        # and only subcanvases under its occupied tiles are subscribed to
+        region = (*self.coord, *(self.coord + self.template_image.shape[:2]))
+        offset = np.tile(self.coord, 2)
+        self.board_subscriber.set_region(
+            region, [np.add(box, offset) for box in self.tiles.boxes]
+        )
+        self.board_subscriber.start(next(iter(self.access_tokens.values())))
+
+        # Update board image if outdated
+        # The subscriber keeps the board current, only changes need to be applied
+        if self.board_outdated.is_set() or self.board is None or template_changed:
+            self.board_outdated.clear()
+            with phase("wait_board"):
+                if self.board is None and not self.board_subscriber.wait_ready():
+                    return  # stopped before the board was received
+            if self.board_subscriber.ready.is_set() and (
+                template_changed or self.board_subscriber.version != self.board_version
+            ):
+                logger.debug("Refresher: Updating board image")
+                colors = self.board_subscriber.get_colors()
+                if self.color_palette != colors:
+                    self.color_palette = colors
+                    colors_changed = True
+                board_changed = True
+
         if colors_changed or template_changed:
-            self.template = ColorMapper.correct_image(self.template, self.color_palette)
+            with phase("correction"):
+                self.template = self.tiles.index_template(
+                    self.template_image,
+                    self.color_palette,
+                    self.correction_memory(),
+                    self.parallel,
+                    self.color_metric,
+                )
 
         if board_changed:
-            self.board = np.swapaxes(
-                board.crop(
-                    (*self.coord, *(self.coord + self.template.shape[:2]))
-                ).convert("RGB"),
-                0,
-                1,
+            boxes, version = self.board_subscriber.changes_since(self.board_version)
+            if boxes is None or colors_changed or template_changed:
+                # Compute wrong pixels (cropped template relative position)
+                # The board outside of the occupied tiles is never read
+                self.board = np.zeros(self.template.shape, dtype=np.uint8)
+                for box in self.tiles.boxes:
+                    board, _ = self.board_subscriber.crop(np.add(box, offset))
+                    x0, y0, x1, y1 = box
+                    self.board[x0:x1, y0:y1] = np.swapaxes(board, 0, 1)
+                self.wrong_pixels = self.new_work_pool()
+                with metrics.time("wrong_pixels_update_seconds", mode="rebuild"):
+                    self.wrong_pixels.rebuild(
+                        self.board, self.template, boxes=self.tiles.boxes
+                    )
+            else:
+                # Only recompute the pixels touched by the board changes
+                # The published board is written in place, readers hold
+                # pool_lock so they never see a box half applied
+                changed = (
+                    part
+                    for box in set(boxes)
+                    for part in self.tiles.clip(np.subtract(box, offset))
+                )
+                for x0, y0, x1, y1 in changed:
+                    board, _ = self.board_subscriber.crop(
+                        np.add((x0, y0, x1, y1), offset)
+                    )
+                    with self.pool_lock, metrics.time(
+                        "wrong_pixels_update_seconds", mode="incremental"
+                    ):
+                        self.board[x0:x1, y0:y1] = np.swapaxes(board, 0, 1)
+                        self.wrong_pixels.update(
+                            self.board, self.template, (x0, y0, x1, y1)
+                        )
+            metrics.set("wrong_pixels", len(self.wrong_pixels))
+            self.board_version = version
+            self.snapshot = Snapshot(
+                self.coord,
+                self.template,
+                self.board,
+                self.wrong_pixels,
+                ColorMapper.palette(self.color_palette),
             )
-            # Compute wrong pixels (cropped template relative position)
-            dist = ColorMapper.redmean_dist(self.board, self.template)
-            coords = np.argwhere(
-                (self.template[...,3] == 255)
-                & (self.template[...,:3] != self.board).any(axis=-1)
-            )  # sorted by distance to target color
-            np.random.shuffle(coords)  # add randomness
-            # use partition instead of sorting to avoid replacing black/white pixels
-            # those have the largest distance
-            coords = coords[
-                np.argpartition(dist[coords[:,0], coords[:,1]],
-                                coords.shape[0] // 2)
-            ]
-            # get rgb values of wrong pixels
-            target_rgb = self.template[coords[:,0], coords[:,1]][:,:3]
-            self.wrong_pixels = list(zip(coords, target_rgb))
-
-        # Save images for debugging
+
+        # Save the state for a warm start of the next run
+        if (
+            board_changed
+            and warmstart.enabled(self)
+            and time.time() >= self.next_warm_save
+        ):
+            self.next_warm_save = time.time() + self.config_get(
+                "warm_start_interval", 60
+            )
+            try:
+                with phase("warm_start_save"):
+                    warmstart.save(self)
+            except OSError as e:
+                logger.warning("Refresher: Failed to save the warm start state: {}", e)
+
+        # Save images for debugging, encoded on the artifact writer thread
+        if not self.config_get("debug_artifacts", False):
+            return
+        palette = ColorMapper.palette_to_rgb(self.color_palette)
         if template_changed or colors_changed:
-            self.save_as_png(self.template, "image_template.png")
+            self.artifacts.submit(
+                "image_template.png", artifacts.template_image, self.template, palette
+            )
         if board_changed:
-            self.save_as_png(self.board, "image_board.png")
-            dist_img = np.empty((*dist.shape[:2], 4))
-            dist_img[..., :3] = dist[..., None] * 255 // dist.max()
-            dist_img[..., 3] = self.template[..., 3]
-            self.save_as_png(dist_img, "image_dist.png")
-
-    def save_as_png(self, image, filename):
-        image = np.swapaxes(image, 0, 1).astype(np.uint8)
-        image = Image.fromarray(image, "RGBA")
-        image.save(filename)
-
-    # Thread-safe config getter
+            self.artifacts.submit(
+                "image_board.png",
+                artifacts.board_image,
+                self.board,
+                self.tiles.mask(),
+                palette,
+            )
+            self.artifacts.submit(
+                "image_dist.png",
+                artifacts.dist_image,
+                self.board,
+                self.template,
+                palette,
+                self.color_metric,
+            )
+
+    # Where the board stream comes from and where it is recorded to
+    def board_source(self):
+        source = connect
+        if self.config_get("board_replay"):
+            source = recording.BoardReplay(
+                self.config_get("board_replay"),
+                self.config_get("board_replay_speed", 1),
+                self.stop_event,
+            )
+        recorder = None
+        if self.config_get("board_recording"):
+            recorder = recording.BoardRecorder(
+                self.config_get("board_recording"), self.stop_event
+            )
+        return source, recorder
+
+    # Empty pool of wrong pixels ordered by the configured priorities
+    def new_work_pool(self):
+        return WorkPool(
+            self.template.shape[:2],
+            ColorMapper.palette_to_rgb(self.color_palette),
+            self.config_get("pixel_priority", []),
+            self.template_layers,
+            self.color_metric,
+        )
+
+    # Memory ceiling for template correction in bytes, None if unbounded
+    def correction_memory(self):
+        limit = self.config_get("correction_memory_mb")
+        return int(limit * 2**20) if limit else None
+
+    # Thread-safe config getter, reads the latest snapshot without locking
     def config_get(self, key, default=None):
-        with self.config_lock:
-            return self.config.get(key, default)
+        return self.config_file.snapshot.get(key, default)
 
-    # Thread-safe config updater
+    # Reloads the config if the file changed
+    # Returns the previous snapshot, None if nothing changed
     def config_update(self):
-        with self.config_lock:
-            self.config = utils.get_json_data(self, self.config_path)
-
-    def get_wrong_pixel(self, username):
-        # Check every 10 seconds for an unset pixel
-        while not self.stop_event.wait(timeout=10):
-            # Threads should have exclusive access to updating data
-            with self.update_lock:
-                # Update information
-                self.update(username)
-
-                # Pop the first unset pixel
-                if len(self.wrong_pixels) > 0:
-                    coord, target_rgb = self.wrong_pixels.pop()
-                    logger.info(
-                        "Thread {}: Found unset pixel at {}",  # shows visual position
-                        username,
-                        coord + self.coord + np.array(self.canvas["offset"]["visual"]),
-                    )
-                    board_rgb = self.board[coord[0], coord[1], :3]
-                    return coord, target_rgb, board_rgb
+        return self.config_file.reload()
+
+    # Returns None if all pixels are correct, otherwise the position,
+    # the color id to place and the rgb values of the target and board color
+    def get_wrong_pixel(self, username, snapshot: Snapshot):
+        # Pop the first unset pixel
+        with self.pool_lock, phase("pop_pixel"):
+            coord = snapshot.pool.pop()
+            if coord is None:
+                return None
+            board = snapshot.board[coord[0], coord[1]]
+        target = snapshot.template[coord[0], coord[1]]
+        coord = coord + snapshot.coord
+        logger.info(
+            "Thread {}: Found unset pixel at {}",  # shows visual position
+            username,
+            coord + np.array(self.canvas["offset"]["visual"]),
+        )
+        return (
+            coord,
+            snapshot.palette.ids[target],
+            snapshot.palette.rgb[target],
+            snapshot.palette.rgb[board],
+        )
 
-            # All pixels correct, try again in 10 seconds
-            logger.info(
-                "Thread {}: All pixels are correct, trying again in 10 seconds...",
-                username,
+    # Queues a popped pixel (global position) again, its placement failed
+    def requeue_pixel(self, coord):
+        snapshot = self.snapshot  # the latest pool, the popped one may be replaced
+        with self.pool_lock:
+            snapshot.pool.requeue(
+                coord - snapshot.coord, snapshot.board, snapshot.template
             )
 
+    # Returns the time of the next placement and whether the pixel was placed
     def set_pixel_get_ratelimit(
         self, color_index, coord, username, target_rgb, board_rgb
     ):
@@ -169,7 +377,7 @@ class PlaceClient:
             "Thread {}: Attempting to place pixel", username
         )
         target_colorname = ColorMapper.color_id_to_name(color_index)
-        board_colorname = ColorMapper.rgb_to_name(board_rgb)
+        board_colorname = ColorMapper.rgb_to_name(board_rgb, self.color_palette)
         print(
             f"Thread {username}",  # shows visual position
             f"Pixel position: {coord + np.array(self.canvas['offset']['visual'])}",
@@ -185,9 +393,10 @@ class PlaceClient:
         subcanvas = (coord // 1000)[0] + 3 * (coord // 1000)[1]
         coord = coord % 1000
 
-        response = connect.set_pixel(
-            self, coord, color_index, subcanvas, self.access_tokens[username]
-        )
+        with metrics.time("set_pixel_seconds"):
+            response = connect.set_pixel(
+                self, coord, color_index, subcanvas, self.access_tokens[username]
+            )
         logger.debug("Thread {}: Received response: {}", username, response.text)
 
         # Successfully placed
@@ -201,13 +410,15 @@ class PlaceClient:
             who_placed = connect.check(self, coord, color_index, subcanvas, username)
             if who_placed == username:
                 logger.success("Thread {}: Succeeded placing pixel", username)
+                metrics.inc("pixels_placed_total", result="placed")
             else:
                 logger.error("Thread {}: POTENTIALLY SHADOW BANNED", username)
+                metrics.inc("pixels_placed_total", result="not_placed")
                 logger.error(
                     "Thread {}: Pixel placed by {}", username or "no one", who_placed
                 )
-                return time.time()
-            return next_time
+                return time.time(), False
+            return next_time, True
 
         logger.debug(response.json().get("errors"))
         errors = response.json().get("errors")[0]
@@ -215,76 +426,107 @@ class PlaceClient:
         # Unknown error
         if "extensions" not in errors:
             logger.error("Thread {}: {}", username, errors.get("message"))
+            metrics.inc("pixels_placed_total", result="error")
             # Wait 1 minute on any other error
-            return 60
+            return time.time() + 60, False
 
         # Rate limited, time in ms
         next_time = errors["extensions"]["nextAvailablePixelTs"] / 1000
+        metrics.inc("pixels_placed_total", result="rate_limited")
         logger.error(
             "Thread {}: Failed placing pixel: rate limited for {:.0f}s",
             username,
             next_time - time.time(),
         )
-        return next_time
+        return next_time, False
 
-    # Draw the input image
+    # Draw one pixel of the input image
+    # Returns the time the worker is due again, None to stop the worker
+    @phase("task")
     def task(self, username, password):
-        # Refresh auth tokens and / or draw a pixel
-        while not self.stop_event.is_set():
-            # get the current time
-            current_time = time.time()
-
-            # Refresh access token if necessary
-            if (
-                username not in self.access_tokens
-                or username not in self.access_token_expires_at_timestamp
-                or (
-                    self.access_token_expires_at_timestamp[username]
-                    and current_time >= self.access_token_expires_at_timestamp[username]
-                )
-            ):
-                logger.debug("Thread {}: Refreshing access token", username)
+        # get the current time
+        current_time = time.time()
+
+        # Refresh access token if necessary
+        if (
+            username not in self.access_tokens
+            or username not in self.access_token_expires_at_timestamp
+            or (
+                self.access_token_expires_at_timestamp[username]
+                and current_time >= self.access_token_expires_at_timestamp[username]
+            )
+        ):
+            logger.debug("Thread {}: Refreshing access token", username)
+            with phase("login"):
                 connect.login(self, username, password, username, current_time)
 
-            # get current pixel position from input image and replacement color
-            relative, target_rgb, board_rgb = self.get_wrong_pixel(username)
+        # Board not received yet, the refresher needs a logged in worker first
+        snapshot = self.snapshot
+        if snapshot is None:
+            logger.info("Thread {}: Waiting for the board...", username)
+            return current_time + (self.config_get("thread_delay") or 3)
 
-            # draw the pixel onto r/place
-            logger.info("Thread {} :: PLACING ::", username)
-            next_placement_time = self.set_pixel_get_ratelimit(
-                ColorMapper.rgb_to_id(target_rgb),
-                self.coord + relative,
+        # get current pixel position from input image and replacement color
+        pixel = self.get_wrong_pixel(username, snapshot)
+        if pixel is None:
+            # All pixels correct, try again in 10 seconds
+            logger.info(
+                "Thread {}: All pixels are correct, trying again in 10 seconds...",
                 username,
-                target_rgb,
-                board_rgb,
             )
+            return current_time + 10
+        coord, color_index, target_rgb, board_rgb = pixel
 
-            # next time until drawing with random offset to try dodging shadow bans
-            time_to_wait = (
-                next_placement_time - current_time + np.random.randint(0, 4) ** 4
-            )
+        # draw the pixel onto r/place
+        logger.info("Thread {} :: PLACING ::", username)
+        placed = False
+        try:
+            with phase("set_pixel"):
+                next_placement_time, placed = self.set_pixel_get_ratelimit(
+                    color_index,
+                    coord,
+                    username,
+                    target_rgb,
+                    board_rgb,
+                )
+        finally:
+            # the pool forgets popped pixels, the board diff won't bring it back
+            if not placed:
+                self.requeue_pixel(coord)
 
-            if time_to_wait > 10000:
-                logger.warning("Thread {} :: CANCELLED :: Rate-Limit Banned", username)
-                return
+        # next time until drawing with random offset to try dodging shadow bans
+        time_to_wait = next_placement_time - current_time + np.random.randint(0, 4) ** 4
 
-            # wait until next rate limit expires
-            logger.info(
-                "Thread {}: Until next placement {:.0f}s", username, time_to_wait
-            )
-            # note: Reddit limits us to place 1 pixel every 5 minutes, so I am setting it to
-            # 5 minutes and 30 seconds per pixel
-            if self.stop_event.wait(time_to_wait):
-                logger.warning(
-                    "Thread {} :: CANCELLED :: Stopped by Main Thread", username
-                )
-                return
+        if time_to_wait > 10000:
+            logger.warning("Thread {} :: CANCELLED :: Rate-Limit Banned", username)
+            return None
+
+        # wait until next rate limit expires
+        logger.info("Thread {}: Until next placement {:.0f}s", username, time_to_wait)
+        # note: Reddit limits us to place 1 pixel every 5 minutes, so I am setting it to
+        # 5 minutes and 30 seconds per pixel
+        # at least 10s later, a due time in the past reruns the worker at once
+        return current_time + max(time_to_wait, 10)
 
     def start(self):
         self.stop_event.clear()
-        threads = {}
+        # Every worker shares the scheduler instead of running its own thread
+        threads = self.config_get("scheduler_threads") or len(
+            self.config_get("workers") or ()
+        )
+        scheduler = Scheduler(self.stop_event, max(threads, 1))
+        threading.Thread(target=scheduler.run, name="scheduler", daemon=True).start()
+        threading.Thread(target=self.refresh, name="refresher", daemon=True).start()
+        started = set()
+        pending = dict(self.config_get("workers"))  # not started yet, one per tick
         i = 0
 
+        # Metrics for unattended runs
+        if self.config_get("metrics_port"):
+            metrics.serve(self.config_get("metrics_port"))
+        metrics_file = self.config_get("metrics_file")
+        next_dump = 0
+
         try:
             while True:
                 i += 1
@@ -303,36 +545,53 @@ class PlaceClient:
                     )
                     self.template_outdated.set()
 
-                # Check if any threads are alive
-                if not any(thread.is_alive() for thread in threads.values()):
-                    logger.warning("Main: All threads died")
+                logger.debug(
+                    "Main: Waited {:.3f}s for the pixel pool over {} acquisitions",
+                    self.pool_lock.wait_time,
+                    self.pool_lock.acquisitions,
+                )
+                metrics.set("pool_lock_wait_seconds_total", self.pool_lock.wait_time)
+                metrics.set("pool_lock_acquisitions_total", self.pool_lock.acquisitions)
+                if metrics_file and time.time() >= next_dump:
+                    metrics.dump(metrics_file)
+                    next_dump = time.time() + self.config_get("metrics_interval", 60)
+
+                # Check if any workers are still scheduled
+                if started and len(scheduler) == 0:
+                    logger.warning("Main: All workers stopped")
                     break
 
-                # Update config
-                logger.debug("Main: Updating config")
+                # Update config, workers are compared only when the file changed
                 try:
-                    self.config_update()
+                    previous = self.config_update()
                 except JSONDecodeError:
                     logger.warning("Main: Failed to update config")
-
-                # Check and add new workers
-                workers = self.config_get("workers")
-                new_workers = workers.keys() - threads.keys()
-                if len(new_workers) > 0:
+                    previous = None
+                if previous is not None:
+                    logger.debug("Main: Config changed")
+                    added, removed = worker_changes(previous, self.config_file.snapshot)
+                    for username in removed:
+                        logger.debug("Main: Removing worker {}", username)
+                        pending.pop(username, None)
+                        scheduler.remove(username)
+                        started.discard(username)
+                    pending.update(added)
+
+                # Add the next new worker
+                if pending:
+                    username = next(iter(pending))
                     logger.debug("Main: Adding new worker {}", username)
-                    username = new_workers.pop()
-                    password = workers[username]
-                    threads[username] = threading.Thread(
-                        target=self.task, args=[username, password]
-                    )
-                    threads[username].daemon = True
-                    threads[username].start()
+                    password = pending.pop(username)
+                    scheduler.add(username, partial(self.task, username, password))
+                    started.add(username)
 
         # Check for ctrl+c
         except KeyboardInterrupt:
-            logger.warning("Main: KeyboardInterrupt received, killing threads...")
-            self.stop_event.set()
-            logger.warning("Main: Threads killed, exiting...")
-            for thread in threads:
-                thread.join()
+            logger.warning("Main: KeyboardInterrupt received, stopping workers...")
+            scheduler.stop()
+            logger.warning("Main: Workers stopped, exiting...")
             exit(0)
+        finally:
+            # The color correction processes don't outlive the client
+            if self.parallel:
+                self.parallel.shutdown()
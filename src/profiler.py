@@ -0,0 +1,126 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Seconds between two samples of every thread stack
+SAMPLE_INTERVAL = 0.005
+
+# Profiler of the running client, None unless main.py runs with --profile
+PROFILER = None
+
+
+@contextmanager
+def phase(name):
+    """
+    Marks a named phase of the current thread for the profiler.
+    Also usable as a decorator, costs nothing while not profiling.
+    """
+    profiler = PROFILER
+    if profiler is None:
+        yield
+        return
+    stack = profiler.phases.setdefault(threading.get_ident(), [])
+    stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.record(tuple(stack), time.perf_counter() - start)
+        stack.pop()
+
+
+class Profiler:
+    """
+    Sampling profiler of every thread, stacks are prefixed by the thread name
+    and the phases active on the thread. Writes folded stacks for
+    flamegraph.pl or speedscope and a summary of the phases.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.started = None
+        self.phases = {}  # thread id -> names of the active phases
+        self.samples = Counter()  # folded stack -> samples
+        self.phase_samples = Counter()  # phase path -> samples
+        self.phase_times = defaultdict(lambda: [0, 0.0, 0.0])  # calls, total, max
+
+    def start(self):
+        global PROFILER
+        PROFILER = self
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        global PROFILER
+        PROFILER = None
+        self.stop_event.set()
+        self.thread.join()
+
+    def record(self, path, seconds):
+        with self.lock:
+            entry = self.phase_times[path]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    filename = os.path.basename(code.co_filename)
+                    stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                phases = tuple(self.phases.get(ident, ()))
+                folded = ";".join(
+                    (names.get(ident, str(ident)), *phases, *reversed(stack))
+                )
+                with self.lock:
+                    self.samples[folded] += 1
+                    if phases:
+                        self.phase_samples[phases] += 1
+
+    def write(self, directory="profiles"):
+        # Writes <start time>.folded and <start time>.txt, returns their prefix
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(
+            directory, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        )
+        with self.lock:
+            samples = dict(self.samples)
+            phase_samples = dict(self.phase_samples)
+            phase_times = {
+                path: list(entry) for path, entry in self.phase_times.items()
+            }
+
+        with open(prefix + ".folded", "w") as f:
+            for stack, count in sorted(samples.items()):
+                f.write(f"{stack} {count}\n")
+
+        total = sum(samples.values()) or 1
+        with open(prefix + ".txt", "w") as f:
+            f.write(
+                f"{'phase':40} {'calls':>8} {'total s':>10} {'mean ms':>10}"
+                f" {'max ms':>10} {'samples':>8}\n"
+            )
+            for path in sorted(phase_times.keys() | phase_samples.keys()):
+                calls, seconds, longest = phase_times.get(path, (0, 0.0, 0.0))
+                mean = seconds / calls * 1000 if calls else 0
+                share = phase_samples.get(path, 0) / total
+                f.write(
+                    f"{'/'.join(path):40} {calls:8} {seconds:10.3f} {mean:10.2f}"
+                    f" {longest * 1000:10.2f} {share:8.1%}\n"
+                )
+        return prefix
@@ -83,9 +83,9 @@ def get_random_proxy(self, username=None):
         self.logger.debug("Using proxy: {}", str(random_proxy))
         return random_proxy
 
-    proxy = (
-        self.config_get("workers")[username].get("personal_proxy") if username else None
-    )
+    # workers are either "username": "password" or an object with a personal proxy
+    worker = self.config_get("workers")[username] if username else None
+    proxy = worker.get("personal_proxy") if isinstance(worker, dict) else None
 
     return {"https": proxy, "http": proxy} if proxy else None
 
@@ -0,0 +1,188 @@
+import json
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from loguru import logger
+from websocket._exceptions import (
+    WebSocketConnectionClosedException,
+    WebSocketTimeoutException,
+)
+
+import src.connect as connect
+
+# A recording is a file of zlib compressed records, each prefixed by its
+# compressed length. A record is the header (receive time, kind, message
+# length), the json message and the frame image exactly as it was downloaded.
+CHUNK_HEADER = struct.Struct("<I")
+RECORD_HEADER = struct.Struct("<dBI")
+CONFIG = 0
+FRAME = 1
+
+# Frames of a replay kept for download
+REPLAY_FRAMES = 1024
+
+
+def read_chunks(f):
+    # Yields the compressed records of an open recording and their end offset
+    while True:
+        header = f.read(CHUNK_HEADER.size)
+        if len(header) < CHUNK_HEADER.size:
+            return
+        (length,) = CHUNK_HEADER.unpack(header)
+        chunk = f.read(length)
+        if len(chunk) < length:
+            return  # cut short by a crash
+        yield chunk, f.tell()
+
+
+def read_records(path):
+    """Yields (receive time, kind, message, frame) of a recording in order."""
+    with open(path, "rb") as f:
+        for chunk, _ in read_chunks(f):
+            record = zlib.decompress(chunk)
+            received, kind, length = RECORD_HEADER.unpack_from(record)
+            message = record[RECORD_HEADER.size : RECORD_HEADER.size + length]
+            frame = record[RECORD_HEADER.size + length :]
+            yield received, kind, json.loads(message), frame
+
+
+class BoardRecorder:
+    """
+    Appends the board stream of a BoardSubscriber to a recording.
+    Records are compressed and written on a background thread.
+    """
+
+    def __init__(self, path, stop_event: threading.Event):
+        self.path = path
+        self.stop_event = stop_event
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self.run, name="board-recorder", daemon=True
+        )
+        self.thread.start()
+
+    def config(self, received, canvas_details):
+        self.queue.put((received, CONFIG, canvas_details, b""))
+
+    def frame(self, received, canvas_index, data, content):
+        message = {"canvas": canvas_index, "data": data}
+        self.queue.put((received, FRAME, message, content))
+
+    def run(self):
+        logger.info("Recording the board to {}", self.path)
+        with open(self.path, "a+b") as f:
+            # Drop a record cut short by a crash, appending after it would
+            # make the rest of the recording unreadable
+            f.seek(0)
+            end = 0
+            for _, end in read_chunks(f):
+                pass
+            f.truncate(end)
+            f.seek(end)
+
+            while not self.stop_event.is_set():
+                try:
+                    received, kind, message, content = self.queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                message = json.dumps(message).encode()
+                record = RECORD_HEADER.pack(received, kind, len(message))
+                chunk = zlib.compress(record + message + content, 1)
+                f.write(CHUNK_HEADER.pack(len(chunk)) + chunk)
+                if self.queue.empty():
+                    f.flush()  # a crash only loses what is still queued
+
+
+class BoardReplay:
+    """
+    Plays a recording to a BoardSubscriber in place of the connect module.
+    The recorded messages arrive at their recorded pace divided by speed,
+    or as fast as they are read with speed 0.
+    """
+
+    def __init__(self, path, speed=1.0, stop_event: threading.Event = None):
+        self.path = path
+        self.speed = speed
+        self.stop_event = stop_event or threading.Event()
+        self.records = read_records(path)
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()  # frame name -> image
+        self.count = 0  # messages played
+        self.finished = threading.Event()
+        self.start = None  # (wall clock, recording time) of the first message
+
+    def connect_realtime(self, client, access_token):
+        if self.finished.is_set():
+            return None
+        return ReplaySocket(self)
+
+    def download_frame(self, client, url):
+        with self.lock:
+            return self.frames.get(url)
+
+    def due(self, received):
+        # Wall clock time a message recorded at received is played at
+        if self.start is None:
+            self.start = (time.time(), received)
+        if not self.speed:
+            return 0
+        return self.start[0] + (received - self.start[1]) / self.speed
+
+    def message(self, record):
+        # The recorded message as the realtime websocket sent it
+        _, kind, message, frame = record
+        self.count += 1
+        if kind == CONFIG:
+            socket_id, data = "1", message
+        else:
+            socket_id = connect.canvas_socket_id(message["canvas"])
+            data = dict(message["data"], name=f"replay:{self.count}")
+            with self.lock:
+                self.frames[data["name"]] = frame
+                while len(self.frames) > REPLAY_FRAMES:
+                    self.frames.popitem(last=False)
+        return json.dumps(
+            {
+                "id": socket_id,
+                "type": "data",
+                "payload": {"data": {"subscribe": {"data": data}}},
+            }
+        )
+
+
+class ReplaySocket:
+    """The websocket side of a replay, subscriptions are ignored."""
+
+    def __init__(self, replay: BoardReplay):
+        self.replay = replay
+        self.timeout = None
+        self.record = None  # next record, read but not played yet
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def send(self, payload):
+        pass
+
+    def close(self):
+        pass
+
+    def recv(self):
+        if self.record is None:
+            self.record = next(self.replay.records, None)
+        if self.record is None:
+            self.replay.finished.set()
+            raise WebSocketConnectionClosedException("Replay finished")
+
+        delay = self.replay.due(self.record[0]) - time.time()
+        if self.timeout is not None and delay > self.timeout:
+            self.replay.stop_event.wait(self.timeout)
+            raise WebSocketTimeoutException()
+        if delay > 0:
+            self.replay.stop_event.wait(delay)
+
+        record, self.record = self.record, None
+        return self.replay.message(record)
@@ -0,0 +1,110 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+from src.metrics import metrics
+
+# Seconds before a job that raised runs again, doubled for every failure in a
+# row up to RETRY_MAX_DELAY
+RETRY_DELAY = 10
+RETRY_MAX_DELAY = 300
+
+
+class Scheduler:
+    """
+    Wakes workers when their cooldown is over from a single thread.
+    A job is a callable returning the timestamp it wants to run at next, or
+    None once it is done. A job that raises is retried with a backoff. Due
+    jobs run on a thread pool, idle jobs only cost a heap entry.
+    """
+
+    def __init__(self, stop_event: threading.Event, max_workers=4):
+        self.stop_event = stop_event
+        self.cond = threading.Condition()
+        self.heap = []  # (due timestamp, sequence, name, job sequence)
+        self.sequence = itertools.count()
+        self.jobs = {}  # name -> (sequence of the add, job)
+        self.lateness = {}  # name -> seconds the last run started late
+        self.failures = {}  # name -> runs in a row that raised
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="worker"
+        )
+
+    def __len__(self):
+        with self.cond:
+            return len(self.jobs)
+
+    def add(self, name, job, due=None):
+        # Replaces a job of the same name, its pending wake-ups are dropped
+        with self.cond:
+            self.jobs[name] = (next(self.sequence), job)
+            self.failures.pop(name, None)
+            self.schedule(name, due or time.time())
+
+    def remove(self, name):
+        # A running job finishes its current run
+        with self.cond:
+            self.jobs.pop(name, None)
+            self.failures.pop(name, None)
+
+    def schedule(self, name, due):
+        # Called with self.cond held
+        added, _ = self.jobs[name]
+        heapq.heappush(self.heap, (due, next(self.sequence), name, added))
+        self.cond.notify()
+
+    def run(self):
+        with self.cond:
+            while not self.stop_event.is_set():
+                now = time.time()
+                while self.heap and self.heap[0][0] <= now:
+                    due, _, name, added = heapq.heappop(self.heap)
+                    if self.jobs.get(name, (None,))[0] != added:
+                        continue  # removed or replaced while waiting
+                    self.executor.submit(self.execute, name, added, due)
+
+                timeout = self.heap[0][0] - now if self.heap else None
+                self.cond.wait(timeout)
+
+    def execute(self, name, added, due):
+        # Lateness includes the time spent waiting for a free thread
+        late = time.time() - due
+        with self.cond:
+            current, job = self.jobs.get(name, (None, None))
+            if current != added:
+                return
+            self.lateness[name] = late
+        metrics.set("worker_wakeup_lateness_seconds", late, worker=name)
+        logger.debug("Scheduler: Running {} {:.3f}s late", name, late)
+
+        failed = False
+        try:
+            due = job()
+        except Exception:
+            failed = True
+            logger.exception("Scheduler: {} failed", name)
+
+        with self.cond:
+            if self.jobs.get(name, (None,))[0] != added:
+                return  # removed or replaced while running
+            if failed:
+                failures = self.failures.get(name, 0) + 1
+                self.failures[name] = failures
+                delay = min(RETRY_DELAY * 2 ** (failures - 1), RETRY_MAX_DELAY)
+                logger.warning("Scheduler: Retrying {} in {}s", name, delay)
+                due = time.time() + delay
+            else:
+                self.failures.pop(name, None)
+            if due is None or self.stop_event.is_set():
+                self.jobs.pop(name)
+            else:
+                self.schedule(name, due)
+
+    def stop(self):
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify()
+        self.executor.shutdown(wait=True)
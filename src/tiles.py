@@ -0,0 +1,81 @@
+import numpy as np
+
+from src.board import intersect
+from src.mappings import ColorMapper
+
+# Edge length of the square tiles a template is split into
+TILE_SIZE = 64
+
+
+class Tiles:
+    """
+    The tiles of a template that hold an opaque pixel, in the (x, y)
+    coordinates of the template arrays. Occupied tiles following each other
+    in a column of tiles are merged into one box. Correction, diffing and
+    board crops only cover these boxes, so they cost as much as the painted
+    area rather than the bounding box of scattered templates.
+    """
+
+    def __init__(self, image: np.ndarray, size=TILE_SIZE):
+        width, height = image.shape[:2]
+        opaque = image[..., 3] == 255  # everything else is TRANSPARENT
+        occupied = np.logical_or.reduceat(opaque, np.arange(0, width, size), axis=0)
+        occupied = np.logical_or.reduceat(occupied, np.arange(0, height, size), axis=1)
+
+        self.size = size
+        self.shape = (width, height)
+        self.columns = []  # (y0, y1) of the runs of occupied tiles per column
+        self.boxes = []  # (x0, y0, x1, y1) of every run
+        for i, column in enumerate(occupied):
+            edges = np.flatnonzero(np.diff(column, prepend=False, append=False))
+            runs = [
+                (int(start) * size, min(int(end) * size, height))
+                for start, end in edges.reshape(-1, 2)
+            ]
+            self.columns.append(runs)
+            x0, x1 = i * size, min((i + 1) * size, width)
+            self.boxes += [(x0, y0, x1, y1) for y0, y1 in runs]
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def area(self):
+        return sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in self.boxes)
+
+    def clip(self, box):
+        # Yields the parts of box = (x0, y0, x1, y1) inside occupied tiles
+        first = max(box[0] // self.size, 0)
+        last = min(-(-box[2] // self.size), len(self.columns))
+        for i in range(first, last):
+            for y0, y1 in self.columns[i]:
+                part = intersect(box, (i * self.size, y0, (i + 1) * self.size, y1))
+                if part is not None:
+                    yield part
+
+    def mask(self):
+        # Pixels covered by the occupied tiles
+        covered = np.zeros(self.shape, dtype=bool)
+        for x0, y0, x1, y1 in self.boxes:
+            covered[x0:x1, y0:y1] = True
+        return covered
+
+    def index_template(
+        self,
+        image: np.ndarray,
+        colors: dict,
+        max_memory: int = None,
+        backend=None,
+        metric: str = "redmean",
+    ) -> np.ndarray:
+        """
+        ColorMapper.index_template of the occupied tiles only, spread over
+        the processes of a ParallelBackend if given.
+        """
+        if backend is not None:
+            return backend.index_template(image, colors, self.boxes, max_memory, metric)
+        ids = np.full(self.shape, ColorMapper.TRANSPARENT, dtype=np.uint8)
+        for x0, y0, x1, y1 in self.boxes:
+            ids[x0:x1, y0:y1] = ColorMapper.index_template(
+                image[x0:x1, y0:y1], colors, max_memory, metric
+            )
+        return ids
@@ -1,9 +1,17 @@
 import numpy as np
 import json
 import os
+import threading
+import time
 import requests
 from PIL import Image, UnidentifiedImageError
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from src.profiler import phase
+
+# Template manifests and images fetched and decoded at the same time
+TEMPLATE_DOWNLOAD_WORKERS = 8
 
 
 def clear():
@@ -11,6 +19,24 @@ def clear():
     return
 
 
+class TimedLock:
+    """Lock that adds up the time spent waiting to acquire it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wait_time = 0.0
+        self.acquisitions = 0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.wait_time += time.perf_counter() - start
+        self.acquisitions += 1
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
 def get_json_data(self, config_path):
     configFilePath = os.path.join(os.getcwd(), config_path)
 
@@ -27,24 +53,28 @@ def get_json_data(self, config_path):
     # Read the input image.jpg file
 
 
+def decode_image(content):
+    image = Image.open(BytesIO(content))
+    # Convert image to RGBA - Transparency should only be supported with PNG
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    image.load()
+    return image
+
+
 def get_json_from_url(self, url):
-    # Get the json data from the url
+    # Get the json data from the url, revalidated through the http cache
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        return self.http_cache.get(url, json.loads)
     except requests.exceptions.RequestException as e:
         self.logger.exception(f"Error fetching data from {url}: {e}")
         return None
 
-    return response.json()
-
 
 def load_image_from_url(self, url):
-    # Get the image from the url
+    # Get the image from the url, revalidated through the http cache
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        image = Image.open(BytesIO(response.content))
+        image = self.http_cache.get(url, decode_image)
     except requests.exceptions.RequestException as e:
         self.logger.exception(f"Error loading image from {url}: {e}")
         return None
@@ -52,21 +82,27 @@ def load_image_from_url(self, url):
         self.logger.exception(f"Coudln't identify image format from {url}")
         return None
 
-    # Convert image to RGBA - Transparency should only be supported with PNG
-    if image.mode != "RGBA":
-        image = image.convert("RGBA")
-        self.logger.debug("Converted to rgba")
-
     self.logger.debug("Loaded image size: {}", image.size)
     return image
 
 
-def load_template_data(self) -> tuple[np.ndarray, Image.Image]:
+@phase("load_template_data")
+def load_template_data(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    with ThreadPoolExecutor(max_workers=TEMPLATE_DOWNLOAD_WORKERS) as executor:
+        return combine_templates(self, executor)
+
+
+def combine_templates(self, executor) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     # Load the template images from the urls
-    templates = []
     urls = self.config_get("template_urls")
-    for url in urls:
-        sources = get_json_from_url(self, url)
+    priority_url = self.config_get("priority_url")
+    manifests = [executor.submit(get_json_from_url, self, url) for url in urls]
+    if priority_url:
+        priority = executor.submit(get_json_from_url, self, priority_url)
+
+    templates = []
+    for manifest in manifests:
+        sources = manifest.result()
         if not sources:
             continue  # skip
         templates += sources["templates"]
@@ -74,13 +110,13 @@ def load_template_data(self) -> tuple[np.ndarray, Image.Image]:
     original_names = set(template["name"] for template in templates)
 
     priority_names = set()
-    try:
-        url = self.config_get("priority_url")
-        if url:
-            for priority_template in get_json_from_url(self, url)["templates"]:
+    if priority_url:
+        sources = priority.result()
+        if sources:
+            for priority_template in sources["templates"]:
                 priority_names.add(priority_template["name"])
-    except requests.exceptions.HTTPError:
-        self.logger.warning("Failed to load priority templates")
+        else:
+            self.logger.warning("Failed to load priority templates")
 
     # use priority unless nothing matches, then use names
     names = priority_names & original_names
@@ -96,33 +132,94 @@ def load_template_data(self) -> tuple[np.ndarray, Image.Image]:
     else:
         self.logger.warning("No template matches names")
 
+    downloads = [
+        executor.submit(load_image_from_url, self, sources["sources"][0])
+        for sources in templates
+    ]
     images = []
-    for sources in templates:
-        image = load_image_from_url(self, sources["sources"][0])
+    loaded = []
+    for sources, download in zip(templates, downloads):
+        image = download.result()
         if not image:
             self.logger.warning("Failed to load image for template {}", sources["name"])
             continue  # skip
         images.append(image)
+        loaded.append(sources)
+    templates = loaded
 
     if not images:
         self.logger.error("Empty templates")
         return None
 
-    # Compute dimensions
     coords = np.array([(template["x"], template["y"]) for template in templates])
-    sizes = np.array([image.size for image in images])
-    dims = coords + sizes
-    # Starting position
-    coord = np.min(coords, axis=0)
-    dim = np.max(dims, axis=0)
-
-    # Combine all images
-    image = Image.new("RGBA", (*dim,))  # canvas in RGBA
-    for i, c in zip(images[::-1], coords[::-1]):
-        image.paste(i, (*c,), i)
-    image = image.crop((*coord, *dim))
+    coord, image, layers = merge_templates(images, coords)
+
+    # Pixels off the canvas can't be placed, they would stay wrong for good
+    offset = np.array(self.canvas["offset"]["template_api"])
+    size = self.canvas.get("size")
+    clipped = clip_template(
+        coord, image, layers, -offset, None if size is None else size - offset
+    )
+    if clipped is None:
+        self.logger.error("Templates are outside of the canvas")
+        return None
+    coord, image, layers = clipped
 
-    self.logger.info("Loaded image size: {}", image.size)
+    self.logger.info("Loaded image size: {}", image.shape[1::-1])
 
     # TEMPLATE API COORDS
-    return coord, image
+    return coord, image, layers
+
+
+def clip_template(coord, image, layers, start, stop=None):
+    """
+    Cuts a merged template at coord down to the (x, y) box from start to
+    stop, unbounded past start if stop is None. Returns None if nothing of
+    the template is left.
+    """
+    end = coord + image.shape[1::-1]
+    lower = np.maximum(coord, start)
+    upper = end if stop is None else np.minimum(end, stop)
+    if np.any(upper <= lower):
+        return None
+    (x0, y0), (x1, y1) = lower - coord, upper - coord
+    return lower, image[y0:y1, x0:x1], layers[y0:y1, x0:x1]
+
+
+def merge_templates(images, coords) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Combines the rgba template images at their coordinates into one array
+    covering their bounding box, the first template wins. Every template is
+    only written to its own footprint, translucent pixels are blended like
+    a PIL paste of the templates in reverse order.
+    """
+    sizes = np.array([image.size for image in images])
+    coord = np.min(coords, axis=0)
+    width, height = np.max(coords + sizes, axis=0) - coord
+
+    image = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels = image.view(np.uint32)[..., 0]  # whole rgba pixels are copied at once
+    # Index of the template each pixel comes from
+    layers = np.full((height, width), len(images), np.min_scalar_type(len(images)))
+    for i in reversed(range(len(images))):
+        template = np.ascontiguousarray(images[i])
+        x, y = coords[i] - coord
+        h, w = template.shape[:2]
+        alpha = template[..., 3]
+        opaque = alpha == 255
+        visible = alpha > 0
+
+        np.copyto(
+            pixels[y : y + h, x : x + w], template.view(np.uint32)[..., 0], where=opaque
+        )
+        np.copyto(layers[y : y + h, x : x + w], i, where=visible)
+
+        # PIL rounding of (target * (255 - alpha) + template * alpha) / 255
+        translucent = visible != opaque
+        if translucent.any():
+            target = image[y : y + h, x : x + w]
+            a = alpha[translucent, None].astype(np.uint32)
+            blend = target[translucent] * (255 - a) + template[translucent] * a + 128
+            target[translucent] = ((blend >> 8) + blend) >> 8
+
+    return coord, image, layers
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from loguru import logger
+
+from src.mappings import ColorMapper
+
+# Directory of the saved states, every save is a new generation directory
+# and current.json names the latest complete one
+WARM_START_DIR = os.path.join("cache", "warm")
+
+# Bumped whenever the saved arrays change meaning
+FORMAT = 1
+
+# Arrays of a saved state, the board is copy-on-write as it is updated in place
+ARRAYS = {
+    "template_image": "r",
+    "template_layers": "r",
+    "template": "r",
+    "board": "c",
+    "wrong": "r",
+}
+
+
+def enabled(self):
+    # Opt-in, a saved state costs a write of the board every interval
+    return self.config_get("warm_start", False)
+
+
+def template_key(self):
+    # Config a saved template was merged from, any change invalidates it
+    return {
+        "template_urls": self.config_get("template_urls"),
+        "priority_url": self.config_get("priority_url"),
+        "names": self.config_get("names", []),
+        "template_api": self.canvas["offset"]["template_api"],
+        "color_metric": self.config_get("color_metric", "redmean"),
+    }
+
+
+def save(self, directory=WARM_START_DIR):
+    """
+    Saves the template, palette, board crop and wrong pixels of the client.
+    Only called by the refresher thread, which owns all of them.
+    """
+    directory = os.path.join(os.getcwd(), directory)
+    generation = f"{time.time_ns()}.{threading.get_ident()}"
+    path = os.path.join(directory, generation)
+    os.makedirs(path)
+
+    arrays = {
+        "template_image": self.template_image,
+        "template_layers": self.template_layers,
+        "template": self.template,
+        "board": self.board,
+    }
+    with self.pool_lock:  # workers clear the pixels they pop
+        arrays["wrong"] = self.wrong_pixels.wrong.copy()
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), array)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "format": FORMAT,
+                "saved_at": time.time(),
+                "template_key": template_key(self),
+                "coord": self.coord.tolist(),
+                "palette": list(self.color_palette.items()),
+            },
+            f,
+        )
+
+    # arrays first, current.json always names a complete generation
+    with open(os.path.join(directory, "current.json.tmp"), "w") as f:
+        json.dump({"generation": generation}, f)
+    os.replace(
+        os.path.join(directory, "current.json.tmp"),
+        os.path.join(directory, "current.json"),
+    )
+    for name in os.listdir(directory):
+        if name != generation and os.path.isdir(os.path.join(directory, name)):
+            # a generation still mapped can't be removed on Windows, retried later
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def load(self, directory=WARM_START_DIR):
+    """
+    Returns the last saved state as a dict of memory-mapped arrays plus
+    coord, palette and saved_at, None if warm starts are off, there is no
+    state or it does not belong to the current config. The board and wrong
+    pixels are dropped once older than warm_start_max_age seconds.
+    """
+    if not enabled(self):
+        return None
+    directory = os.path.join(os.getcwd(), directory)
+    try:
+        with open(os.path.join(directory, "current.json")) as f:
+            path = os.path.join(directory, json.load(f)["generation"])
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError, KeyError):
+        return None
+    if meta.get("format") != FORMAT or meta.get("template_key") != template_key(self):
+        logger.info("Warm start: Saved state is for another config, ignored")
+        return None
+
+    try:
+        state = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mode)
+            for name, mode in ARRAYS.items()
+        }
+    except (OSError, ValueError):
+        logger.warning("Warm start: Saved state is unreadable, ignored")
+        return None
+    try:
+        palette = dict(meta["palette"])
+    except (KeyError, TypeError, ValueError):
+        palette = {}
+    # indices past the palette would fail once a worker looks up their color
+    template, colors = state["template"], len(palette)
+    shape = state["template_image"].shape[:2]
+    if (
+        any(state[name].shape[:2] != shape for name in ARRAYS)
+        or not colors
+        or np.any((template >= colors) & (template != ColorMapper.TRANSPARENT))
+        or np.any(state["board"] >= colors)
+    ):
+        logger.warning("Warm start: Saved state is inconsistent, ignored")
+        return None
+
+    state["coord"] = np.array(meta["coord"])
+    state["palette"] = palette
+    state["saved_at"] = meta["saved_at"]
+    if time.time() - meta["saved_at"] > self.config_get("warm_start_max_age", 600):
+        state["board"] = state["wrong"] = None  # the template is still current
+    return state
@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def lut_dir(tmp_path_factory):
+    # Lookup tables are built into a temporary cache directory
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("lut"))
+        yield
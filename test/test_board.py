@@ -0,0 +1,139 @@
+import threading
+from io import BytesIO
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.board import BoardSubscriber
+from src.mappings import ColorMapper
+
+# Two subcanvases side by side, the region overlaps both
+CANVAS_SIZE = 100
+REGION = (50, 20, 150, 80)
+
+
+class FrameSource:
+    # Serves encoded frames by name, like connect.download_frame
+    def __init__(self):
+        self.frames = {}
+
+    def add(self, name, image):
+        buffer = BytesIO()
+        Image.fromarray(image).save(buffer, "PNG")
+        self.frames[name] = buffer.getvalue()
+
+    def download_frame(self, client, url):
+        return self.frames.get(url)
+
+
+def palette_frame(rng, alpha=None):
+    # Frame of random palette colors, opaque unless alpha is given
+    rgb = ColorMapper.palette_to_rgb(ColorMapper.FULL_COLOR_MAP)
+    ids = rng.integers(0, len(rgb), (CANVAS_SIZE, CANVAS_SIZE))
+    image = np.empty((CANVAS_SIZE, CANVAS_SIZE, 4), dtype=np.uint8)
+    image[..., :3] = rgb[ids]
+    image[..., 3] = 255 if alpha is None else alpha
+    return image, ids
+
+
+@pytest.fixture
+def board():
+    board = BoardSubscriber(
+        SimpleNamespace(stop_event=threading.Event()), FrameSource()
+    )
+    board.canvas_details = {
+        "canvasWidth": CANVAS_SIZE,
+        "canvasHeight": CANVAS_SIZE,
+        "canvasConfigurations": [
+            {"index": 0, "dx": 0, "dy": 0},
+            {"index": 1, "dx": CANVAS_SIZE, "dy": 0},
+        ],
+    }
+    board.colors = dict(ColorMapper.FULL_COLOR_MAP)
+    board.set_region(REGION)
+    board.subscribed = board.overlapping()
+    yield board
+    board.downloads.shutdown()
+
+
+def receive(board, canvas_index, name, data, mode):
+    # Downloads a frame and applies it once decoded
+    board.download(canvas_index, {"name": name, **data}, mode)
+    while board.pending:
+        board.pending[0][-1].result()
+        board.apply_pending(None)
+
+
+def full_frames(board, rng):
+    # Both subcanvases get a full frame, returns the palette indices [y, x]
+    ids = []
+    for i in range(2):
+        image, frame_ids = palette_frame(rng)
+        board.source.add(f"full{i}", image[..., :3])
+        data = {"__typename": "FullFrameMessageData", "timestamp": 1}
+        receive(board, i, f"full{i}", data, "RGB")
+        ids.append(frame_ids)
+    return np.concatenate(ids, axis=1)
+
+
+def region_of(canvas):
+    x0, y0, x1, y1 = REGION
+    return canvas[y0:y1, x0:x1]
+
+
+def test_full_frames_fill_the_region(board):
+    canvas = full_frames(board, np.random.default_rng(0))
+    assert board.ready.is_set()
+    assert np.array_equal(board.board, region_of(canvas))
+
+
+def test_diff_frame_changes_only_its_pixels(board):
+    rng = np.random.default_rng(1)
+    canvas = full_frames(board, rng)
+    _, version = board.changes_since(-1)
+
+    alpha = np.zeros((CANVAS_SIZE, CANVAS_SIZE), dtype=np.uint8)
+    alpha[30, 70] = alpha[40, 75] = 255  # inside the region
+    alpha[5, 5] = 255  # outside of it
+    image, ids = palette_frame(rng, alpha)
+    board.source.add("diff0", image)
+    data = {
+        "__typename": "DiffFrameMessageData",
+        "previousTimestamp": 1,
+        "currentTimestamp": 2,
+    }
+    receive(board, 0, "diff0", data, "RGBA")
+
+    canvas[:, :CANVAS_SIZE][alpha > 0] = ids[alpha > 0]
+    assert np.array_equal(board.board, region_of(canvas))
+    boxes, _ = board.changes_since(version)
+    assert boxes == [(70, 30, 76, 41)]
+
+
+def test_frames_are_indexed_inside_the_region_only(board, monkeypatch):
+    shapes = []
+    index_image_lut = ColorMapper.index_image_lut
+
+    def recording(image, *args, **kwargs):
+        shapes.append(image.shape[:2])
+        return index_image_lut(image, *args, **kwargs)
+
+    monkeypatch.setattr(ColorMapper, "index_image_lut", recording)
+    full_frames(board, np.random.default_rng(2))
+    height = REGION[3] - REGION[1]
+    assert shapes == [(height, 50), (height, 50)]
+
+
+def test_frames_of_an_old_region_are_dropped(board):
+    rng = np.random.default_rng(3)
+    image, _ = palette_frame(rng)
+    board.source.add("full0", image[..., :3])
+    data = {"name": "full0", "__typename": "FullFrameMessageData", "timestamp": 1}
+    board.download(0, data, "RGB")
+    board.set_region((0, 0, 60, 60))
+    board.pending[0][-1].result()
+    board.apply_pending(None)
+    assert 0 not in board.timestamps
+    assert not board.board.any()
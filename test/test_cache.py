@@ -0,0 +1,119 @@
+import json
+import os
+
+import pytest
+import requests
+
+import src.cache
+from src.cache import HttpCache
+
+URL = "https://example.com/template.json"
+
+
+class Server:
+    # Stands in for requests.get, answers 304 while the ETag matches
+    def __init__(self, body=b'{"x": 1}', etag='"v1"', last_modified=None):
+        self.body, self.etag, self.last_modified = body, etag, last_modified
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        headers = headers or {}
+        self.requests.append(headers)
+        response = requests.Response()
+        response.url = url
+        if self.etag and headers.get("If-None-Match") == self.etag:
+            response.status_code = 304
+            response._content = b""
+            return response
+        response.status_code = 200
+        response._content = self.body
+        if self.etag:
+            response.headers["ETag"] = self.etag
+        if self.last_modified:
+            response.headers["Last-Modified"] = self.last_modified
+        return response
+
+
+class Decoder:
+    # json.loads counting its calls
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, content):
+        self.calls += 1
+        return json.loads(content)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = Server()
+    monkeypatch.setattr(src.cache.requests, "get", server.get)
+    return server
+
+
+def test_not_modified_reuses_the_decoded_value(server, tmp_path):
+    cache, decode = HttpCache(tmp_path), Decoder()
+    value = cache.get(URL, decode)
+    assert value == {"x": 1}
+    assert server.requests == [{}]
+
+    assert cache.get(URL, decode) is value
+    assert server.requests[-1] == {"If-None-Match": '"v1"'}
+    assert decode.calls == 1
+
+
+def test_body_and_validators_are_kept_on_disk(server, tmp_path):
+    server.last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+    HttpCache(tmp_path).get(URL, json.loads)
+    with open(HttpCache(tmp_path).path(URL) + ".json") as f:
+        assert json.load(f) == {
+            "url": URL,
+            "etag": '"v1"',
+            "last_modified": "Wed, 21 Oct 2015 07:28:00 GMT",
+        }
+
+    # a new cache, as after a restart, decodes the stored body once
+    cache, decode = HttpCache(tmp_path), Decoder()
+    assert cache.get(URL, decode) == {"x": 1}
+    assert server.requests[-1] == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+    }
+    cache.get(URL, decode)
+    assert decode.calls == 1
+
+
+def test_a_changed_body_is_decoded_again(server, tmp_path):
+    cache = HttpCache(tmp_path)
+    cache.get(URL, json.loads)
+    server.body, server.etag = b'{"x": 2}', '"v2"'
+    assert cache.get(URL, json.loads) == {"x": 2}
+    assert cache.get(URL, json.loads) == {"x": 2}
+    assert server.requests[-1] == {"If-None-Match": '"v2"'}
+
+
+def test_a_missing_body_is_fetched_again(server, tmp_path):
+    HttpCache(tmp_path).get(URL, json.loads)
+    os.remove(HttpCache(tmp_path).path(URL))
+    assert HttpCache(tmp_path).get(URL, json.loads) == {"x": 1}
+    assert server.requests[-2:] == [{"If-None-Match": '"v1"'}, {}]
+
+
+def test_responses_without_validators_are_not_stored(server, tmp_path):
+    server.etag = None
+    cache = HttpCache(tmp_path)
+    cache.get(URL, json.loads)
+    cache.get(URL, json.loads)
+    assert server.requests == [{}, {}]
+    assert not os.path.exists(cache.path(URL) + ".json")
+
+
+def test_errors_are_raised(server, tmp_path, monkeypatch):
+    def not_found(url, headers=None, **kwargs):
+        response = requests.Response()
+        response.status_code, response.url = 404, url
+        return response
+
+    monkeypatch.setattr(src.cache.requests, "get", not_found)
+    with pytest.raises(requests.HTTPError):
+        HttpCache(tmp_path).get(URL, json.loads)
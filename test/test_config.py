@@ -0,0 +1,81 @@
+import json
+import os
+
+import pytest
+
+from src.config import ConfigFile, worker_changes
+
+
+def write(path, config, mtime_ns=None):
+    path.write_text(config if isinstance(config, str) else json.dumps(config))
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_reload_only_reads_a_changed_file(tmp_path):
+    path = tmp_path / "config.json"
+    write(path, {"thread_delay": 2}, mtime_ns=10**18)
+    config = ConfigFile(str(path))
+    assert config.snapshot["thread_delay"] == 2
+    assert config.reload() is None
+
+    # same size and modification time, the file isn't read again
+    write(path, {"thread_delay": 3}, mtime_ns=10**18)
+    assert config.reload() is None
+    assert config.snapshot["thread_delay"] == 2
+
+    os.utime(path, ns=(10**18 + 1, 10**18 + 1))
+    previous = config.reload()
+    assert previous["thread_delay"] == 2
+    assert config.snapshot["thread_delay"] == 3
+    with pytest.raises(TypeError):
+        config.snapshot["thread_delay"] = 4  # snapshots are read-only
+
+
+def test_a_replaced_file_is_read_again(tmp_path):
+    path = tmp_path / "config.json"
+    write(path, {"thread_delay": 2}, mtime_ns=10**18)
+    config = ConfigFile(str(path))
+    replacement = tmp_path / "config.json.new"
+    write(replacement, {"thread_delay": 5}, mtime_ns=10**18)
+    os.replace(replacement, path)  # a new inode
+    assert config.reload() is not None
+    assert config.snapshot["thread_delay"] == 5
+
+
+def test_a_broken_file_keeps_the_previous_config(tmp_path):
+    path = tmp_path / "config.json"
+    write(path, {"thread_delay": 2})
+    config = ConfigFile(str(path))
+    write(path, '{"thread_delay": ', mtime_ns=10**18)
+    with pytest.raises(json.JSONDecodeError):
+        config.reload()
+    assert config.snapshot["thread_delay"] == 2
+    # read again next time, until it is fixed
+    with pytest.raises(json.JSONDecodeError):
+        config.reload()
+    write(path, {"thread_delay": 3}, mtime_ns=10**18 + 1)
+    assert config.reload()["thread_delay"] == 2
+    assert config.snapshot["thread_delay"] == 3
+
+
+def test_worker_changes():
+    previous = {
+        "workers": {
+            "kept": {"password": "a"},
+            "removed": {"password": "b"},
+            "changed": {"password": "c"},
+        }
+    }
+    config = {
+        "workers": {
+            "kept": {"password": "a"},
+            "changed": {"password": "d"},
+            "added": {"password": "e"},
+        }
+    }
+    added, removed = worker_changes(previous, config)
+    assert added == {"changed": {"password": "d"}, "added": {"password": "e"}}
+    assert sorted(removed) == ["changed", "removed"]
+    assert worker_changes({}, config)[0] == config["workers"]
+    assert worker_changes(config, {"workers": None}) == ({}, list(config["workers"]))
@@ -0,0 +1,36 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from src.mappings import ColorMapper
+
+
+def random_image(shape=(240, 300), seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (*shape, 4), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("max_memory", [1, 2**16, 2**20])
+def test_tiled_correction_matches_whole_image(max_memory):
+    image = random_image()
+    colors = ColorMapper.FULL_COLOR_MAP
+    expected = ColorMapper.correct_image(image, colors)
+    assert np.array_equal(
+        ColorMapper.correct_image(image, colors, max_memory), expected
+    )
+
+
+def test_tiled_correction_stays_below_max_memory():
+    image = random_image((1000, 500))
+    colors = ColorMapper.FULL_COLOR_MAP
+    max_memory = 4 * 2**20
+    ColorMapper.correct_image(image[:1], colors)  # palette compiled outside
+
+    tracemalloc.start()
+    try:
+        corrected = ColorMapper.correct_image(image, colors, max_memory)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # the corrected image itself is the only allocation beyond the blocks
+    assert peak - corrected.nbytes <= max_memory
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from src.distance import METRICS, ColorMetric, ciede2000, get_metric, rgb_to_lab
+from src.mappings import ColorMapper
+from src.pixels import WorkPool
+
+# Pairs of Sharma, Wu and Dalal (2005), L*a*b* of both colors and their CIEDE2000
+SHARMA = [
+    (50.0, 2.6772, -79.7751, 50.0, 0.0, -82.7485, 2.0425),
+    (50.0, 3.1571, -77.2803, 50.0, 0.0, -82.7485, 2.8615),
+    (50.0, 2.8361, -74.0200, 50.0, 0.0, -82.7485, 3.4412),
+    (50.0, 0.0, 0.0, 50.0, -1.0, 2.0, 2.3669),
+    (50.0, 2.4900, -0.0010, 50.0, -2.4900, 0.0009, 7.1792),
+    (60.2574, -34.0099, 36.2677, 60.4626, -34.1751, 39.4387, 1.2644),
+    (2.0776, 0.0795, -1.1350, 0.9033, -0.0636, -0.5514, 0.9082),
+]
+
+
+def palette():
+    return ColorMapper.palette_to_rgb(ColorMapper.FULL_COLOR_MAP)
+
+
+def test_ciede2000_matches_reference_data():
+    data = np.array(SHARMA, dtype=np.float32)
+    dist = ciede2000(data[:, :3], data[:, 3:6])
+    assert np.allclose(dist, data[:, 6], atol=1e-3)
+    assert np.allclose(ciede2000(data[:, 3:6], data[:, :3]), dist, atol=1e-3)
+
+
+def test_lab_of_white_and_black():
+    lab = rgb_to_lab(np.array([[255, 255, 255], [0, 0, 0]], dtype=np.uint8))
+    assert np.allclose(lab, [[100, 0, 0], [0, 0, 0]], atol=1e-2)
+
+
+def test_redmean_is_512_times_float_redmean():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (50, 60, 3)).astype(float)
+    target = rng.integers(0, 256, 3).astype(float)
+    mean_r = (image[..., 0] + target[0]) / 2
+    delta = (image - target) ** 2
+    expected = (
+        (2 + mean_r / 256) * delta[..., 0]
+        + 4 * delta[..., 1]
+        + (3 - mean_r / 256) * delta[..., 2]
+    )
+    dist = get_metric("redmean").distance(image.astype(np.uint8), target.astype(int))
+    assert dist.dtype == np.int32
+    assert np.array_equal(dist, expected * 512)
+
+
+@pytest.mark.parametrize("name", list(METRICS))
+def test_table_is_symmetric_and_zero_on_the_diagonal(name):
+    table = get_metric(name).table(palette())
+    assert table.shape == (len(palette()),) * 2
+    assert np.allclose(table, table.T)
+    assert np.all(np.diag(table) == 0)
+    assert np.all(table[~np.eye(len(table), dtype=bool)] > 0)
+
+
+@pytest.mark.parametrize("name", list(METRICS))
+def test_nearest_rows_pick_the_closest_color(name):
+    metric = get_metric(name)
+    colors = palette()
+    start, stop = 127, 129
+    lut = metric.nearest_rows(colors, start, stop)
+
+    values = np.arange(256)
+    rgb = np.stack(np.meshgrid(np.arange(start, stop), values, values, indexing="ij"))
+    rgb = np.moveaxis(rgb, 0, -1).astype(np.uint8)
+    dist = np.stack([metric.distance(rgb, color) for color in colors], axis=-1)
+    picked = np.take_along_axis(dist, lut[..., None].astype(np.intp), axis=-1)
+    # float32 metrics may pick either of two nearly equal colors
+    assert np.allclose(picked[..., 0], dist.min(axis=-1), rtol=1e-5, atol=1e-4)
+
+
+def test_unknown_metric():
+    with pytest.raises(KeyError):
+        get_metric("cie94")
+
+
+@pytest.mark.parametrize("name", ["cie76"])  # the ciede2000 table takes minutes
+def test_lut_matches_correct_image(name):
+    image = np.random.default_rng(1).integers(0, 256, (40, 50, 4), dtype=np.uint8)
+    colors = ColorMapper.FULL_COLOR_MAP
+    expected = ColorMapper.correct_image(image, colors, metric=name)
+    corrected = ColorMapper.correct_image_lut(image, colors, metric=name)
+    # the table may pick the other one of two colors equal in float32
+    assert (corrected != expected).any(axis=-1).mean() < 0.001
+
+
+@pytest.mark.parametrize("name", list(METRICS))
+def test_distance_priority_pops_the_furthest_pixel_first(name):
+    table = get_metric(name).table(palette())
+    board = np.zeros((1, 3), dtype=np.uint8)
+    template = np.argsort(table[0])[[5, 30, 15]].astype(np.uint8)[None, :]
+    pool = WorkPool(board.shape, palette(), ["distance"], metric=name)
+    pool.rebuild(board, template)
+    order = [tuple(pool.pop()) for _ in range(3)]
+    assert order == [(0, 1), (0, 2), (0, 0)]
+
+
+@pytest.mark.parametrize("name", list(METRICS))
+def test_distances_match_distance_per_color(name):
+    metric = get_metric(name)
+    image = np.random.default_rng(2).integers(0, 256, (20, 30, 4), dtype=np.uint8)
+    expected = np.stack([metric.distance(image, color) for color in palette()], -1)
+    assert np.allclose(metric.distances(image, palette()), expected, atol=1e-4)
+
+
+def test_metrics_implement_distance_and_nearest_rows():
+    class Incomplete(ColorMetric):
+        def distance(self, image, target):
+            return 0
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from src.mappings import ColorMapper
+
+
+def float_redmean_correct(image: np.ndarray, colors: dict) -> np.ndarray:
+    # correct_image before the lookup table, redmean in float64
+    rgb = ColorMapper.palette_to_rgb(colors).astype(float)
+    pixels = image[..., :3].astype(float)
+    dist = np.empty(image.shape[:2] + (rgb.shape[0],))
+    for i, color in enumerate(rgb):
+        mean_r = 0.5 * pixels[..., 0] + 0.5 * color[0]
+        delta = (pixels - color) ** 2
+        dist[..., i] = (
+            (2 + mean_r / 256) * delta[..., 0]
+            + 4 * delta[..., 1]
+            + (3 - mean_r / 256) * delta[..., 2]
+        )
+    corrected = np.empty_like(image)
+    corrected[..., :3] = rgb[np.argmin(dist, axis=-1)].astype(np.uint8)
+    corrected[..., 3] = image[..., 3]
+    return corrected
+
+
+def grid_image():
+    # Every 5th value of each channel, 0 and 255 included
+    values = np.arange(0, 256, 5, dtype=np.uint8)
+    r, g, b = np.meshgrid(values, values, values, indexing="ij")
+    image = np.stack([r, g, b, np.full_like(r, 255)], axis=-1)
+    return image.reshape(values.size, -1, 4)
+
+
+def random_image(seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (300, 400, 4), dtype=np.uint8)
+
+
+@pytest.mark.parametrize(
+    "image", [grid_image(), random_image()], ids=["grid", "random"]
+)
+def test_lut_matches_float_redmean(image):
+    colors = ColorMapper.FULL_COLOR_MAP
+    expected = float_redmean_correct(image, colors)
+    assert np.array_equal(ColorMapper.correct_image_lut(image, colors), expected)
+    assert np.array_equal(ColorMapper.correct_image(image, colors), expected)
+
+
+def test_lut_matches_float_redmean_small_palette():
+    colors = dict(list(ColorMapper.FULL_COLOR_MAP.items())[::3])
+    image = random_image(1)
+    expected = float_redmean_correct(image, colors)
+    assert np.array_equal(ColorMapper.correct_image_lut(image, colors), expected)
+
+
+def test_index_template_is_transparent_where_not_opaque():
+    image = random_image(2)
+    image[..., 3] = np.where(image[..., 3] > 128, 255, image[..., 3])
+    ids = ColorMapper.index_template(image, ColorMapper.FULL_COLOR_MAP)
+    opaque = image[..., 3] == 255
+    assert np.all(ids[~opaque] == ColorMapper.TRANSPARENT)
+    rgb = ColorMapper.palette_to_rgb(ColorMapper.FULL_COLOR_MAP)
+    expected = float_redmean_correct(image, ColorMapper.FULL_COLOR_MAP)
+    assert np.array_equal(rgb[ids[opaque]], expected[opaque][:, :3])
@@ -0,0 +1,78 @@
+import numpy as np
+from PIL import Image
+
+from src.utils import clip_template, merge_templates
+
+
+def pil_merge(images, coords):
+    # merge_templates before numpy, a PIL paste in reverse order
+    sizes = np.array([image.size for image in images])
+    coord = np.min(coords, axis=0)
+    dim = np.max(coords + sizes, axis=0)
+    image = Image.new("RGBA", (*dim,))
+    for template, c in zip(images[::-1], coords[::-1]):
+        image.paste(template, (*c,), template)
+    image = image.crop((*coord, *dim))
+
+    layers = np.full(image.size[::-1], len(images))
+    for i, (template, c) in reversed(list(enumerate(zip(images, coords - coord)))):
+        visible = np.array(template.getchannel("A")) > 0
+        w, h = template.size
+        layers[c[1] : c[1] + h, c[0] : c[0] + w][visible] = i
+    return coord, np.array(image), layers
+
+
+def random_templates(rng, count, translucent=False):
+    images, coords = [], []
+    for _ in range(count):
+        w, h = rng.integers(5, 60, 2)
+        image = rng.integers(0, 256, (h, w, 4), dtype=np.uint8)
+        alpha = rng.choice([0, 255], (h, w))
+        if translucent:
+            alpha = np.where(rng.random((h, w)) < 0.3, image[..., 3], alpha)
+        image[..., 3] = alpha
+        images.append(Image.fromarray(image, "RGBA"))
+        coords.append(rng.integers(0, 80, 2))
+    return images, np.array(coords)
+
+
+def test_merge_matches_pil_paste():
+    rng = np.random.default_rng(0)
+    for count in (1, 2, 5):
+        for translucent in (False, True):
+            images, coords = random_templates(rng, count, translucent)
+            coord, image, layers = merge_templates(images, coords)
+            expected_coord, expected_image, expected_layers = pil_merge(images, coords)
+            assert np.array_equal(coord, expected_coord)
+            assert np.array_equal(image, expected_image)
+            assert np.array_equal(layers, expected_layers)
+
+
+def test_merge_keeps_templates_at_negative_coordinates():
+    image = np.zeros((2, 3, 4), dtype=np.uint8)
+    image[...] = (10, 20, 30, 255)
+    coords = np.array([(-5, -4), (2, 1)])
+    coord, merged, layers = merge_templates([Image.fromarray(image)] * 2, coords)
+    assert tuple(coord) == (-5, -4)
+    assert merged.shape == (7, 10, 4)
+    assert np.all(merged[:2, :3] == (10, 20, 30, 255))
+    assert np.all(layers[:2, :3] == 0) and np.all(layers[5:7, 7:10] == 1)
+    assert not merged[2:5].any()
+
+
+def test_clip_cuts_off_pixels_outside_of_the_canvas():
+    image = np.arange(7 * 10 * 4, dtype=np.uint8).reshape(7, 10, 4)
+    layers = np.arange(7 * 10).reshape(7, 10)
+    coord = np.array([-5, -4])
+    clipped_coord, clipped, clipped_layers = clip_template(
+        coord, image, layers, (0, 0), (3, 100)
+    )
+    assert tuple(clipped_coord) == (0, 0)
+    assert np.array_equal(clipped, image[4:, 5:8])
+    assert np.array_equal(clipped_layers, layers[4:, 5:8])
+
+    # unbounded past the start, and nothing left
+    unbounded = clip_template(coord, image, layers, (-100, -100))
+    assert tuple(unbounded[0]) == (-5, -4)
+    assert np.array_equal(unbounded[1], image)
+    assert clip_template(coord, image, layers, (5, 0)) is None
@@ -0,0 +1,43 @@
+import numpy as np
+
+from src.mappings import ColorMapper, Palette
+
+# Ids out of order and not contiguous, like a reduced event palette
+COLORS = {"#FF4500": 2, "#000000": 27, "#FFFFFF": 31, "#00A368": 6}
+
+
+def test_palette_indices_follow_the_map_order():
+    palette = Palette(COLORS)
+    assert len(palette) == 4
+    assert palette.ids.tolist() == [2, 27, 31, 6]
+    assert palette.rgb.tolist() == [
+        [255, 69, 0],
+        [0, 0, 0],
+        [255, 255, 255],
+        [0, 163, 104],
+    ]
+
+
+def test_rgb_to_index_and_id_convert_arrays():
+    palette = Palette(COLORS)
+    rgb = palette.rgb[np.array([[3, 0, 2], [1, 1, 0]])]
+    assert palette.rgb_to_index(rgb).tolist() == [[3, 0, 2], [1, 1, 0]]
+    assert palette.rgb_to_id(rgb).tolist() == [[6, 2, 31], [27, 27, 2]]
+
+
+def test_colors_outside_the_palette_are_minus_one():
+    palette = Palette(COLORS)
+    # below, between and above the packed palette colors
+    rgb = np.array([[0, 0, 1], [255, 69, 1], [255, 255, 254], [0, 163, 104]])
+    assert palette.rgb_to_index(rgb).tolist() == [-1, -1, -1, 3]
+    assert palette.rgb_to_id(rgb).tolist() == [-1, -1, -1, 6]
+    assert palette.rgb_to_id(np.array([1, 2, 3])) == -1
+
+
+def test_every_color_round_trips_through_its_id():
+    colors = ColorMapper.FULL_COLOR_MAP
+    palette = ColorMapper.palette(colors)
+    assert palette.rgb_to_id(palette.rgb).tolist() == list(colors.values())
+    for rgb, (color_hex, color_id) in zip(palette.rgb, colors.items()):
+        assert ColorMapper.rgb_to_hex(rgb) == color_hex
+        assert ColorMapper.rgb_to_id(rgb) == color_id
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from src.mappings import ColorMapper
+from src.parallel import ParallelBackend, SharedArray
+from src.tiles import Tiles
+
+
+@pytest.fixture(scope="module")
+def backend():
+    backend = ParallelBackend(2)
+    yield backend
+    backend.shutdown()
+
+
+def random_image(shape=(130, 90), seed=0):
+    image = np.random.default_rng(seed).integers(0, 256, (*shape, 4), dtype=np.uint8)
+    image[..., 3] = np.where(image[..., 3] > 64, 255, 0)
+    return image
+
+
+def test_shared_array_is_shared_by_name():
+    with SharedArray((4, 5), np.uint16) as shared:
+        shared.array[...] = np.arange(20).reshape(4, 5)
+        attached = SharedArray(*shared.spec)
+        assert np.array_equal(attached.array, shared.array)
+        attached.close()
+
+
+def test_bands_cover_the_image_once(backend):
+    covered = np.zeros((103, 7), dtype=int)
+    for x0, y0, x1, y1 in backend.bands(covered.shape):
+        covered[x0:x1, y0:y1] += 1
+    assert np.all(covered == 1)
+
+
+def test_build_lut_matches_single_process(backend):
+    rgb = ColorMapper.palette_to_rgb(ColorMapper.FULL_COLOR_MAP)
+    assert np.array_equal(backend.build_lut(rgb), ColorMapper.build_lut(rgb))
+
+
+def test_index_template_matches_single_process(backend):
+    image = random_image()
+    colors = ColorMapper.FULL_COLOR_MAP
+    expected = ColorMapper.index_template(image, colors)
+    assert np.array_equal(backend.index_template(image, colors), expected)
+    tiles = Tiles(image, size=32)
+    assert np.array_equal(
+        tiles.index_template(image, colors, backend=backend), expected
+    )
+
+
+def test_correct_image_matches_single_process(backend):
+    image = random_image(seed=1)
+    colors = ColorMapper.FULL_COLOR_MAP
+    expected = ColorMapper.correct_image(image, colors)
+    assert np.array_equal(backend.correct_image(image, colors), expected)
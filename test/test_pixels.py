@@ -0,0 +1,79 @@
+import numpy as np
+
+from src.mappings import ColorMapper
+from src.pixels import WorkPool
+
+SHAPE = (60, 40)
+
+
+def palette():
+    return ColorMapper.palette_to_rgb(ColorMapper.FULL_COLOR_MAP)
+
+
+def random_arrays(rng, colors=4):
+    # (x, y) board and template of a few palette indices, a quarter transparent
+    board = rng.integers(0, colors, SHAPE).astype(np.uint8)
+    template = rng.integers(0, colors, SHAPE).astype(np.uint8)
+    template[rng.random(SHAPE) < 0.25] = ColorMapper.TRANSPARENT
+    layers = rng.integers(0, 3, SHAPE)
+    return board, template, layers
+
+
+def drain(pool):
+    popped = []
+    while (coord := pool.pop()) is not None:
+        popped.append(tuple(coord))
+    return popped
+
+
+def test_updates_match_a_rebuild():
+    rng = np.random.default_rng(0)
+    board, template, layers = random_arrays(rng)
+    pool = WorkPool(SHAPE, palette(), ["template", "distance"], layers)
+    pool.rebuild(board, template)
+
+    for _ in range(50):
+        x0, y0 = rng.integers(0, SHAPE)
+        x1, y1 = x0 + rng.integers(1, 15), y0 + rng.integers(1, 15)
+        board = board.copy()
+        region = board[x0:x1, y0:y1]
+        region[...] = rng.integers(0, 4, region.shape)
+        pool.update(board, template, (x0, y0, x1, y1))
+
+    expected = WorkPool(SHAPE, palette(), ["template", "distance"], layers)
+    expected.rebuild(board, template)
+    assert np.array_equal(pool.wrong, expected.wrong)
+    assert len(pool) == len(expected)
+
+    popped = drain(pool)
+    assert len(pool) == 0 and pool.pop() is None
+    assert sorted(popped) == sorted(drain(expected))
+    # template first, distances are those of when a pixel became wrong
+    coords = np.array(popped)
+    order = layers[coords[:, 0], coords[:, 1]]
+    assert np.all(np.diff(order) >= 0)
+
+
+def test_a_pixel_queued_again_pops_once():
+    board = np.zeros((1, 2), dtype=np.uint8)
+    template = np.ones((1, 2), dtype=np.uint8)
+    pool = WorkPool(board.shape, palette())
+    pool.rebuild(board, template)
+    fixed = template.copy()
+    pool.update(fixed, template, (0, 0, 1, 2))
+    assert len(pool) == 0
+    pool.update(board, template, (0, 0, 1, 2))  # wrong again
+    assert sorted(drain(pool)) == [(0, 0), (0, 1)]
+
+
+def test_requeue_puts_a_failed_pixel_back():
+    board = np.zeros((1, 1), dtype=np.uint8)
+    template = np.ones((1, 1), dtype=np.uint8)
+    pool = WorkPool(board.shape, palette())
+    pool.rebuild(board, template)
+    coord = pool.pop()
+    pool.requeue(coord, board, template)
+    pool.requeue(coord, board, template)  # already queued
+    assert drain(pool) == [(0, 0)]
+    pool.requeue(coord, template, template)  # the board shows it correct
+    assert len(pool) == 0
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from websocket._exceptions import WebSocketConnectionClosedException
+
+from src.recording import (
+    CHUNK_HEADER,
+    CONFIG,
+    FRAME,
+    BoardRecorder,
+    BoardReplay,
+    read_records,
+)
+
+# Recordings are written to the temporary directory of conftest.lut_dir
+CANVAS = {"canvasConfigurations": [{"index": 0, "dx": 0, "dy": 0}]}
+FRAMES = [
+    (0, {"__typename": "FullFrameMessageData", "timestamp": 1}, b"\x89PNG full"),
+    (1, {"__typename": "DiffFrameMessageData", "currentTimestamp": 2}, b"diff"),
+]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def record(path, received=100.0):
+    # Records the canvas config and FRAMES, returns once they are on disk
+    before = len(list(read_records(path))) if os.path.exists(path) else 0
+    stop_event = threading.Event()
+    recorder = BoardRecorder(path, stop_event)
+    recorder.config(received, CANVAS)
+    for i, (canvas_index, data, content) in enumerate(FRAMES):
+        recorder.frame(received + i + 1, canvas_index, data, content)
+    wait_for(
+        lambda: os.path.exists(path) and len(list(read_records(path))) == before + 3
+    )
+    stop_event.set()
+    recorder.thread.join(5)
+
+
+def test_a_recording_replays_its_messages():
+    record("replay.rec")
+    records = list(read_records("replay.rec"))
+    assert [r[:2] for r in records] == [(100.0, CONFIG), (101.0, FRAME), (102.0, FRAME)]
+    assert records[0][2:] == (CANVAS, b"")
+
+    replay = BoardReplay("replay.rec", speed=0)
+    socket = replay.connect_realtime(None, "token")
+    message = json.loads(socket.recv())
+    assert message["id"] == "1"
+    assert message["payload"]["data"]["subscribe"]["data"] == CANVAS
+    for canvas_index, data, content in FRAMES:
+        message = json.loads(socket.recv())
+        assert message["id"] == str(2 + canvas_index)
+        played = message["payload"]["data"]["subscribe"]["data"]
+        assert replay.download_frame(None, played.pop("name")) == content
+        assert played == data
+
+    with pytest.raises(WebSocketConnectionClosedException):
+        socket.recv()
+    assert replay.finished.is_set()
+    assert replay.connect_realtime(None, "token") is None
+
+
+def test_a_truncated_record_is_dropped_and_appended_after():
+    record("cut.rec")
+    with open("cut.rec", "ab") as f:
+        f.write(CHUNK_HEADER.pack(100) + b"cut short")
+    assert len(list(read_records("cut.rec"))) == 3
+
+    record("cut.rec", received=200.0)
+    records = list(read_records("cut.rec"))
+    assert [r[0] for r in records] == [100.0, 101.0, 102.0, 200.0, 201.0, 202.0]
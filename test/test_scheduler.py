@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from src import scheduler as scheduler_module
+from src.scheduler import Scheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(threading.Event(), max_workers=1)
+    thread = threading.Thread(target=scheduler.run, daemon=True)
+    thread.start()
+    yield scheduler
+    scheduler.stop()
+    thread.join(1)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_jobs_run_in_due_order(scheduler):
+    runs = []
+    now = time.time()
+    for name, delay in [("c", 0.15), ("a", 0.05), ("b", 0.1)]:
+        scheduler.add(name, lambda name=name: runs.append(name), now + delay)
+    wait_for(lambda: len(runs) == 3)
+    assert runs == ["a", "b", "c"]
+    assert len(scheduler) == 0  # None ends a job
+    assert set(scheduler.lateness) == {"a", "b", "c"}
+
+
+def test_a_job_removed_while_pending_does_not_run(scheduler):
+    runs = []
+    now = time.time()
+    scheduler.add("removed", lambda: runs.append("removed"), now + 0.05)
+    scheduler.add("kept", lambda: runs.append("kept"), now + 0.1)
+    scheduler.remove("removed")
+    wait_for(lambda: runs)
+    time.sleep(0.1)
+    assert runs == ["kept"]
+
+
+def test_a_replaced_job_runs_once(scheduler):
+    runs = []
+    scheduler.add("worker", lambda: runs.append("old"), time.time() + 0.05)
+    scheduler.add("worker", lambda: runs.append("new"), time.time() + 0.05)
+    wait_for(lambda: runs)
+    time.sleep(0.1)
+    assert runs == ["new"]
+
+
+def test_a_failing_job_is_retried_with_a_backoff(scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "RETRY_DELAY", 0.05)
+    runs = []
+
+    def job():
+        runs.append(time.time())
+        if len(runs) < 3:
+            raise RuntimeError("boom")
+        return None
+
+    scheduler.add("worker", job)
+    wait_for(lambda: len(runs) == 3)
+    wait_for(lambda: len(scheduler) == 0)
+    first, second = runs[1] - runs[0], runs[2] - runs[1]
+    assert first >= 0.05 and second >= 0.1
+    assert scheduler.failures == {}
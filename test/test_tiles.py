@@ -0,0 +1,46 @@
+import numpy as np
+
+from src.mappings import ColorMapper
+from src.tiles import Tiles
+
+
+def scattered_template(rng, shape=(300, 200), size=16):
+    # rgba (x, y) template with opaque squares in a few tiles only
+    image = np.zeros((*shape, 4), dtype=np.uint8)
+    for x, y in rng.integers(0, np.array(shape) - size, (6, 2)):
+        image[x : x + size, y : y + size] = rng.integers(0, 256, (size, size, 4))
+        image[x : x + size, y : y + size, 3] = 255
+    return image
+
+
+def test_tiles_cover_every_opaque_pixel():
+    image = scattered_template(np.random.default_rng(0))
+    tiles = Tiles(image, size=32)
+    covered = tiles.mask()
+    opaque = image[..., 3] == 255
+    assert np.all(covered[opaque])
+    assert tiles.area() == covered.sum() < covered.size
+    # every box is a run of tiles holding an opaque pixel
+    for x0, y0, x1, y1 in tiles.boxes:
+        for y in range(y0, y1, 32):
+            assert opaque[x0:x1, y : y + 32].any()
+
+
+def test_clip_keeps_the_covered_part_of_a_box():
+    image = scattered_template(np.random.default_rng(1))
+    tiles = Tiles(image, size=32)
+    box = (40, 30, 250, 170)
+    clipped = np.zeros(tiles.shape, dtype=bool)
+    for x0, y0, x1, y1 in tiles.clip(box):
+        assert not clipped[x0:x1, y0:y1].any()  # the parts don't overlap
+        clipped[x0:x1, y0:y1] = True
+    inside = np.zeros(tiles.shape, dtype=bool)
+    inside[40:250, 30:170] = True
+    assert np.array_equal(clipped, inside & tiles.mask())
+
+
+def test_index_template_matches_whole_template():
+    image = scattered_template(np.random.default_rng(2))
+    colors = ColorMapper.FULL_COLOR_MAP
+    ids = Tiles(image).index_template(image, colors)
+    assert np.array_equal(ids, ColorMapper.index_template(image, colors))
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import src.warmstart as warmstart
+from src.mappings import ColorMapper
+from src.pixels import WorkPool
+
+SHAPE = (6, 4)
+
+
+def client(**config):
+    # The parts of a PlaceClient that warm starts save and load
+    config = {"warm_start": True, "template_urls": ["a.json"], **config}
+    rng = np.random.default_rng(0)
+    template = rng.integers(0, 4, SHAPE).astype(np.uint8)
+    template[0] = ColorMapper.TRANSPARENT
+    board = rng.integers(0, 4, SHAPE).astype(np.uint8)
+    palette = ColorMapper.palette_to_rgb(ColorMapper.FULL_COLOR_MAP)
+    pool = WorkPool(SHAPE, palette)
+    pool.rebuild(board, template)
+    return SimpleNamespace(
+        config_get=lambda key, default=None: config.get(key, default),
+        canvas={"offset": {"template_api": [0, 0]}},
+        template_image=rng.integers(0, 256, (*SHAPE, 4), dtype=np.uint8),
+        template_layers=np.zeros(SHAPE, dtype=int),
+        template=template,
+        board=board,
+        pool_lock=threading.Lock(),
+        wrong_pixels=pool,
+        coord=np.array([10, 20]),
+        color_palette=dict(ColorMapper.FULL_COLOR_MAP),
+    )
+
+
+def edit_meta(directory, **changes):
+    with open(os.path.join(directory, "current.json")) as f:
+        path = os.path.join(directory, json.load(f)["generation"], "meta.json")
+    with open(path) as f:
+        meta = json.load(f)
+    meta.update(changes)
+    with open(path, "w") as f:
+        json.dump(meta, f)
+
+
+def test_a_saved_state_loads_back(tmp_path):
+    saved = client()
+    warmstart.save(saved, tmp_path)
+    state = warmstart.load(client(), tmp_path)
+    for name in warmstart.ARRAYS:
+        expected = saved.wrong_pixels.wrong if name == "wrong" else getattr(saved, name)
+        assert np.array_equal(state[name], expected)
+    assert state["coord"].tolist() == [10, 20]
+    assert state["palette"] == ColorMapper.FULL_COLOR_MAP
+    state["board"][0, 0] = 5  # copy-on-write, the saved file stays as it was
+    assert warmstart.load(client(), tmp_path)["board"][0, 0] == saved.board[0, 0]
+
+
+def test_warm_starts_are_opt_in(tmp_path):
+    warmstart.save(client(), tmp_path)
+    assert not warmstart.enabled(client(warm_start=None))
+    assert warmstart.load(client(warm_start=None), tmp_path) is None
+    assert warmstart.load(client(warm_start=False), tmp_path) is None
+
+
+def test_only_the_latest_generation_is_kept(tmp_path):
+    warmstart.save(client(), tmp_path)
+    warmstart.save(client(), tmp_path)
+    generations = [name for name in os.listdir(tmp_path) if name != "current.json"]
+    assert len(generations) == 1
+
+    # current.json naming a generation that is gone
+    with open(tmp_path / "current.json", "w") as f:
+        json.dump({"generation": f"{time.time_ns()}.1"}, f)
+    assert warmstart.load(client(), tmp_path) is None
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"format": warmstart.FORMAT + 1},
+        {"template_key": {"template_urls": ["b.json"]}},
+        {"palette": []},
+        {"palette": list(ColorMapper.FULL_COLOR_MAP.items())[:3]},  # index 3 used
+    ],
+)
+def test_other_formats_configs_and_palettes_are_rejected(tmp_path, changes):
+    warmstart.save(client(), tmp_path)
+    edit_meta(tmp_path, **changes)
+    assert warmstart.load(client(), tmp_path) is None
+
+
+def test_a_changed_config_is_rejected(tmp_path):
+    warmstart.save(client(), tmp_path)
+    assert warmstart.load(client(color_metric="cie76"), tmp_path) is None
+    assert warmstart.load(client(names=["other"]), tmp_path) is None
+
+
+def test_arrays_of_different_shapes_are_rejected(tmp_path):
+    saved = client()
+    saved.board = np.zeros((SHAPE[0] + 1, SHAPE[1]), dtype=np.uint8)
+    warmstart.save(saved, tmp_path)
+    assert warmstart.load(client(), tmp_path) is None
+
+
+def test_an_old_board_is_dropped(tmp_path):
+    warmstart.save(client(), tmp_path)
+    edit_meta(tmp_path, saved_at=time.time() - 1000)
+    state = warmstart.load(client(warm_start_max_age=600), tmp_path)
+    assert state["board"] is None and state["wrong"] is None
+    assert state["template"] is not None
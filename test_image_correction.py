@@ -5,6 +5,7 @@ from PIL import Image
 from io import BytesIO
 import numpy as np
 import time
+import tracemalloc
 
 from src.mappings import ColorMapper
 from test.mappings import closest_color
@@ -23,7 +24,14 @@ for url in urls:
     templates += sources['templates']
 
 total_time = 0
+total_time_lut = 0
 total_time_old = 0
+total_time_tiled = 0
+peak_memory = 0
+peak_memory_tiled = 0
+
+# memory ceiling of the tiled correction in bytes
+TILED_MAX_MEMORY = 64 * 2**20
 
 for template in templates:
     name = template['name']
@@ -35,9 +43,36 @@ for template in templates:
     image.save(f"images/{name}.png")
     image = np.array(image)
 
+    tracemalloc.start()
     current_time = time.time()
     corrected_image_numpy = ColorMapper.correct_image(image, ColorMapper.FULL_COLOR_MAP)
     total_time += time.time() - current_time
+    peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    current_time = time.time()
+    corrected_image_tiled = ColorMapper.correct_image(
+        image, ColorMapper.FULL_COLOR_MAP, TILED_MAX_MEMORY
+    )
+    total_time_tiled += time.time() - current_time
+    peak_memory_tiled = max(peak_memory_tiled, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    equal_tiled = np.array_equal(corrected_image_numpy, corrected_image_tiled)
+    print("Corrected {} image. Numpy {} Tiled".format(
+        name, '==' if equal_tiled else '!='
+    ))
+
+    current_time = time.time()
+    corrected_image_lut = ColorMapper.correct_image_lut(image, ColorMapper.FULL_COLOR_MAP)
+    total_time_lut += time.time() - current_time
+
+    # the lookup table must reproduce correct_image byte for byte
+    equal_lut = np.array_equal(corrected_image_numpy, corrected_image_lut)
+    print("Corrected {} image. Numpy {} LUT".format(
+        name, '==' if equal_lut else '!='
+    ))
 
     current_time = time.time()
     corrected_image_base = np.empty_like(image)
@@ -62,4 +97,10 @@ for template in templates:
 
 print(f"Average image correction time")
 print(f"numpy: {total_time / len(templates)}")
+print(f"lut: {total_time_lut / len(templates)}")
+print(f"tiled: {total_time_tiled / len(templates)}")
 print(f"base: {total_time_old / len(templates)}")
+
+print(f"Peak image correction memory")
+print(f"numpy: {peak_memory / 2**20:.1f} MiB")
+print(f"tiled: {peak_memory_tiled / 2**20:.1f} MiB")